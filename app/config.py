@@ -17,17 +17,65 @@ class Settings(BaseSettings):
     secret_key: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 1440
+    auth_cache_ttl_seconds: int = int(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+    auth_cache_max_entries: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000))
+    user_cache_ttl_seconds: int = int(os.getenv("USER_CACHE_TTL_SECONDS", 30))
+    user_cache_max_entries: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+    password_hash_workers: int = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+    password_hash_queue_limit: int = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 32))
+    password_hash_retry_after_seconds: int = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", 1))
 
     # MongoDB
     mongodb_uri: str = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
     mongodb_db: str = os.getenv("MONGODB_DB", "smb02_db")
     mongodb_user: str = os.getenv("MONGODB_USER", "root")
     mongodb_password: str = os.getenv("MONGODB_PASSWORD", "password")
+    mongodb_max_pool_size: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", 100))
+    mongodb_min_pool_size: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+    mongodb_connect_timeout_ms: int = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", 5000))
+    mongodb_server_selection_timeout_ms: int = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
 
     # Hugging Face
     hf_token: str = os.getenv("HF_TOKEN", "")
     model_name: str = os.getenv("MODEL_NAME", "QuantFactory/BitNet-3B-1.58-nf4")
     model_cache_dir: str = os.getenv("MODEL_CACHE_DIR", "./models_cache")
+    draft_model_name: str = os.getenv("DRAFT_MODEL_NAME", "")  # small model with the same tokenizer, "" = no speculative decoding
+    draft_num_tokens: int = int(os.getenv("DRAFT_NUM_TOKENS", 5))  # tokens proposed per step (adapted at runtime)
+    model_warmup_runs: int = int(os.getenv("MODEL_WARMUP_RUNS", 2))
+    model_ready_timeout_seconds: float = float(os.getenv("MODEL_READY_TIMEOUT_SECONDS", 10))  # wait before 503
+    model_retry_after_seconds: int = int(os.getenv("MODEL_RETRY_AFTER_SECONDS", 5))
+    model_backend: str = os.getenv("MODEL_BACKEND", "hf")  # "hf", "cpu-int8" or "mock"
+    cpu_threads: int = int(os.getenv("CPU_THREADS", 0))  # 0 = torch default
+    torch_compile: bool = os.getenv("TORCH_COMPILE", "false").lower() == "true"
+
+    # Generation batching
+    generation_max_batch_size: int = int(os.getenv("GENERATION_MAX_BATCH_SIZE", 8))
+    generation_max_wait_ms: int = int(os.getenv("GENERATION_MAX_WAIT_MS", 20))
+    bulk_batch_size: int = int(os.getenv("BULK_BATCH_SIZE", 32))
+    bulk_max_upload_bytes: int = int(os.getenv("BULK_MAX_UPLOAD_BYTES", 50 * 1024 * 1024))  # 0 = no limit
+    mail_max_new_tokens: int = int(os.getenv("MAIL_MAX_NEW_TOKENS", 200))  # a short cold email
+    chat_max_new_tokens: int = int(os.getenv("CHAT_MAX_NEW_TOKENS", 256))
+    generation_timeout_seconds: float = float(os.getenv("GENERATION_TIMEOUT_SECONDS", 120))  # per request, 0 = none
+    generation_concurrency: int = int(os.getenv("GENERATION_CONCURRENCY", 16))  # generation requests in flight, all plans
+    generation_queue_timeout_seconds: float = float(os.getenv("GENERATION_QUEUE_TIMEOUT_SECONDS", 10))  # wait for a slot before 503
+    kv_cache_max_bytes: int = int(os.getenv("KV_CACHE_MAX_BYTES", 1024 * 1024 * 1024))  # 0 = off
+    generation_deterministic: bool = os.getenv("GENERATION_DETERMINISTIC", "false").lower() == "true"  # greedy + response cache
+    response_cache_size: int = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+    response_cache_db_path: str = os.getenv("RESPONSE_CACHE_DB_PATH", "./response_cache/responses.db")  # "" = memory only
+    response_cache_disk_entries: int = int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES", 100000))
+
+    # Mail templates
+    template_cache_size: int = int(os.getenv("TEMPLATE_CACHE_SIZE", 256))
+    template_max_length: int = int(os.getenv("TEMPLATE_MAX_LENGTH", 20000))
+
+    # Campaign jobs
+    jobs_db_path: str = os.getenv("JOBS_DB_PATH", "./jobs/jobs.db")
+    job_workers: int = int(os.getenv("JOB_WORKERS", 2))
+    job_batch_size: int = int(os.getenv("JOB_BATCH_SIZE", 8))
+    job_poll_interval_ms: int = int(os.getenv("JOB_POLL_INTERVAL_MS", 1000))
+    job_max_recipients: int = int(os.getenv("JOB_MAX_RECIPIENTS", 10000))
+    job_priority: int = int(os.getenv("JOB_PRIORITY", 10))  # scheduled after interactive requests of every plan
+    job_lease_seconds: float = float(os.getenv("JOB_LEASE_SECONDS", 300))  # claims not renewed for this long are requeued
 
     # Frontend
     frontend_url: str = os.getenv("FRONTEND_URL", "http://localhost:8000")
@@ -39,6 +87,12 @@ class Settings(BaseSettings):
 
     # Memory
     memory_dir: str = os.getenv("MEMORY_DIR", "./memory")
+    memory_fsync: str = os.getenv("MEMORY_FSYNC", "never")  # "always" or "never"
+    memory_io_workers: int = int(os.getenv("MEMORY_IO_WORKERS", 8))
+    memory_cache_max_bytes: int = int(os.getenv("MEMORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    memory_flush_interval_ms: int = int(os.getenv("MEMORY_FLUSH_INTERVAL_MS", 500))  # 0 = write-through
+    context_max_tokens: int = int(os.getenv("CONTEXT_MAX_TOKENS", 1024))
+    context_summary_tokens: int = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 128))  # 0 = no rolling summary
 
     # API Config
     apify_api_token: str = os.getenv("APIFY_API_TOKEN", "")
@@ -51,6 +105,31 @@ class Settings(BaseSettings):
         "BUSINESS": 999999
     }
 
+    # Generation admission: lower priority is served first; per plan, how many
+    # requests may generate at once and how many more may wait (then 429)
+    plan_priorities: ClassVar[Dict[str, int]] = {
+        "BUSINESS": 0,
+        "ULTRA": 1,
+        "PRO": 2,
+        "FREE": 3
+    }
+    generation_plan_concurrency: ClassVar[Dict[str, int]] = {
+        "BUSINESS": 16,
+        "ULTRA": 8,
+        "PRO": 6,
+        "FREE": 2
+    }
+    generation_plan_queue: ClassVar[Dict[str, int]] = {
+        "BUSINESS": 64,
+        "ULTRA": 16,
+        "PRO": 8,
+        "FREE": 4
+    }
+
+    # Quota leases: plans whose requests are reserved in blocks per process
+    quota_lease_size: int = int(os.getenv("QUOTA_LEASE_SIZE", 50))
+    quota_lease_plans: List[str] = ["ULTRA", "BUSINESS"]
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -0,0 +1,88 @@
+from fastapi import Depends, HTTPException, Request, status
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+from app.config import settings
+from app.services.admission_control import AdmissionController
+from app.services.bitnet_loader import BitNetLoader
+from app.services.job_queue import JobQueue
+from app.services.memory_service import MemoryService
+from app.services.password_hasher import PasswordHasher
+from app.services.subscription_service import QuotaLeases, SubscriptionService
+from app.services.template_service import TemplateService
+from app.services.ttl_cache import TTLCache
+
+# Shared by every route so they all see the same cache and write-behind buffer
+memory_service = MemoryService(
+    settings.memory_dir,
+    fsync=settings.memory_fsync,
+    io_workers=settings.memory_io_workers,
+    cache_max_bytes=settings.memory_cache_max_bytes,
+    flush_interval_ms=settings.memory_flush_interval_ms,
+    context_max_tokens=settings.context_max_tokens,
+    context_summary_tokens=settings.context_summary_tokens
+)
+
+# Process-wide so leases outlive the per-request SubscriptionService
+quota_leases = QuotaLeases(settings.quota_lease_size, settings.quota_lease_plans)
+user_cache = TTLCache(settings.user_cache_max_entries, settings.user_cache_ttl_seconds)
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_queue_limit)
+
+# Workers are started in lifespan once the model is loaded
+job_queue = JobQueue(
+    settings.jobs_db_path,
+    workers=settings.job_workers,
+    batch_size=settings.job_batch_size,
+    poll_interval_ms=settings.job_poll_interval_ms,
+    priority=settings.job_priority,
+    lease_seconds=settings.job_lease_seconds
+)
+
+generation_admission = AdmissionController(
+    settings.plan_priorities,
+    settings.generation_plan_concurrency,
+    settings.generation_plan_queue,
+    concurrency=settings.generation_concurrency,
+    timeout_seconds=settings.generation_queue_timeout_seconds
+)
+
+
+async def get_model_loader(request: Request) -> BitNetLoader:
+    """Get the application-wide model loader, waiting briefly if it is still warming up"""
+    loader = getattr(request.app.state, "model_loader", None)
+    if loader is None or not await loader.wait_ready(settings.model_ready_timeout_seconds):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Model is {loader.state if loader else 'not loaded'}, try again shortly",
+            headers={"Retry-After": str(settings.model_retry_after_seconds)}
+        )
+    return loader
+
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    """Create the application-wide MongoDB client (one pool per process)"""
+    return AsyncIOMotorClient(
+        settings.mongodb_uri,
+        maxPoolSize=settings.mongodb_max_pool_size,
+        minPoolSize=settings.mongodb_min_pool_size,
+        connectTimeoutMS=settings.mongodb_connect_timeout_ms,
+        serverSelectionTimeoutMS=settings.mongodb_server_selection_timeout_ms
+    )
+
+
+def get_db(request: Request) -> AsyncIOMotorDatabase:
+    """Get the database from the client created in lifespan"""
+    return request.app.state.mongo_client[settings.mongodb_db]
+
+
+def get_users_collection(db: AsyncIOMotorDatabase = Depends(get_db)) -> AsyncIOMotorCollection:
+    return db["users"]
+
+
+def get_subscription_service(
+    users_collection: AsyncIOMotorCollection = Depends(get_users_collection)
+) -> SubscriptionService:
+    return SubscriptionService(users_collection, quota_leases, user_cache)
+
+
+def get_template_service(db: AsyncIOMotorDatabase = Depends(get_db)) -> TemplateService:
+    return TemplateService(db["templates"])
@@ -1,13 +1,17 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from contextlib import asynccontextmanager
 import os
 
 from app.config import settings
-from app.routes import auth, chat, history, billing, linkedin
+from app.routes import auth, chat, history, billing, linkedin, jobs, templates
 from app.services.bitnet_loader import BitNetLoader
+from app.services.mail_generator import MailGenerator
+from app.dependencies import create_mongo_client, generation_admission, job_queue, memory_service, quota_leases
+from app.services.subscription_service import SubscriptionService
+from app.services.template_service import TemplateService
 
 # Global state
 app_state = {
@@ -19,16 +23,29 @@ async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown"""
     # Startup
     print("🚀 Starting SMB02 Outreach Engine...")
+    app.state.mongo_client = create_mongo_client()
+    users_collection = app.state.mongo_client[settings.mongodb_db]["users"]
+    await SubscriptionService(users_collection).ensure_indexes()
+    await TemplateService(app.state.mongo_client[settings.mongodb_db]["templates"]).ensure_indexes()
+    print("✅ Database indexes ready")
     app_state["model_loader"] = BitNetLoader(settings)
-    await app_state["model_loader"].initialize()
-    print("✅ Model loaded successfully")
+    app.state.model_loader = app_state["model_loader"]
+    # Loads and warms up in the background; generation endpoints wait for it
+    app.state.model_loader.start()
+    memory_service.use_tokenizer(app.state.model_loader)
+    memory_service.start()
+    await job_queue.start(app.state.model_loader)
     
     yield
     
     # Shutdown
     print("🛑 Shutting down SMB02 Outreach Engine...")
+    await job_queue.stop()
+    await memory_service.close()
+    await quota_leases.release(users_collection)
     if app_state["model_loader"]:
         await app_state["model_loader"].unload()
+    app.state.mongo_client.close()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -57,6 +74,8 @@ app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(history.router, prefix="/api/history", tags=["History"])
 app.include_router(billing.router, prefix="/api/billing", tags=["Billing"])
 app.include_router(linkedin.router, prefix="/api/linkedin", tags=["LinkedIn"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["Jobs"])
+app.include_router(templates.router, prefix="/api/templates", tags=["Templates"])
 
 # Root routes
 @app.get("/")
@@ -79,13 +98,37 @@ async def docs_page():
     """Documentation page"""
     return FileResponse("app/templates/docs.html", media_type="text/html")
 
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Ready once the model is loaded and warmed up"""
+    loader = app_state["model_loader"]
+    model = loader.status if loader else {"state": "idle"}
+    if not loader or not loader.ready:
+        return JSONResponse(status_code=503, content={"status": "not_ready", "model": model})
+    return {"status": "ready", "model": model}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    loader = app_state["model_loader"]
     return {
         "status": "healthy",
         "app": settings.app_name,
-        "version": settings.app_version
+        "version": settings.app_version,
+        "model": loader.status if loader else None,
+        "memory_cache": memory_service.stats,
+        "quota_leases": quota_leases.stats,
+        "kv_cache": loader.prefix_cache.stats if loader else None,
+        "response_cache": loader.response_cache.stats if loader and loader.response_cache else None,
+        "speculative": loader.speculative.stats if loader and loader.speculative else None,
+        "admission": generation_admission.stats,
+        "jobs": job_queue.stats,
+        "templates": MailGenerator.registry.stats
     }
 
 if __name__ == "__main__":
@@ -1,17 +1,31 @@
 from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthCredential
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, date
+import hashlib
+import time
 import jwt
 from typing import Optional
 
 from app.config import settings
+from app.dependencies import generation_admission, get_subscription_service
+from app.services.admission_control import GenerationRejected
 from app.services.subscription_service import SubscriptionService
+from app.services.ttl_cache import TTLCache
 
 security = HTTPBearer()
 
-async def get_current_user(credentials: HTTPAuthCredential = Depends(security)):
+# sha256(token) -> user_id for tokens that already passed verification
+token_cache = TTLCache(settings.auth_cache_max_entries, settings.auth_cache_ttl_seconds)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Extract and validate JWT token"""
     token = credentials.credentials
+    token_key = hashlib.sha256(token.encode()).digest()
+    
+    user_id = token_cache.get(token_key)
+    if user_id is not None:
+        return user_id
+    
     try:
         payload = jwt.decode(
             token,
@@ -38,13 +52,23 @@ async def get_current_user(credentials: HTTPAuthCredential = Depends(security)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Never cache a token past its own expiry
+    exp = payload.get("exp")
+    token_cache.set(token_key, user_id, exp - time.time() if exp is not None else None)
+    
     return user_id
 
-async def check_quota(user_id: str = Depends(get_current_user)):
-    """Middleware to check subscription quota"""
-    subscription_service = SubscriptionService()
+async def increment_usage(
+    user_id: str = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service)
+):
+    """Check the daily quota and count this request in one atomic update"""
     
-    # Get user from database
+    user = await subscription_service.consume_quota(user_id)
+    if user:
+        return user
+    
+    # Only the rejection path pays for a second read, to tell why
     user = await subscription_service.get_user(user_id)
     if not user:
         raise HTTPException(
@@ -52,21 +76,40 @@ async def check_quota(user_id: str = Depends(get_current_user)):
             detail="User not found"
         )
     
-    # Check if daily counter needs reset
-    await subscription_service.reset_daily_counter_if_needed(user)
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail=f"Daily quota exceeded for {user['plan']} plan. Please upgrade or try again tomorrow.",
+        headers={"X-Quota-Exceeded": "true"}
+    )
+
+async def generation_slot(
+    user_id: str = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service)
+):
+    """Admit the request to the model by plan priority, before any quota is charged
+    
+    Rejections answer 429 (the plan's queue is full) or 503 (no slot freed
+    up in time), both with Retry-After. The slot is released when the
+    request ends unless the route hands it off to a streamed response.
+    """
+    user = await subscription_service.get_user(user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
     
-    # Check quota
-    if not await subscription_service.check_quota(user):
+    try:
+        slot = await generation_admission.hold(user["plan"])
+    except GenerationRejected as e:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Daily quota exceeded for {user['plan']} plan. Please upgrade or try again tomorrow.",
-            headers={"X-Quota-Exceeded": "true"}
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS if e.queue_full else status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many {e.plan} generation requests in progress, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
         )
     
-    return user
-
-async def increment_usage(user: dict = Depends(check_quota)):
-    """Increment user's daily request count"""
-    subscription_service = SubscriptionService()
-    await subscription_service.increment_usage(user)
-    return user
\ No newline at end of file
+    try:
+        yield slot
+    finally:
+        if not slot.handed_off:
+            slot.release()
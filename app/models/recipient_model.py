@@ -0,0 +1,15 @@
+from pydantic import BaseModel, model_validator
+
+class Recipient(BaseModel):
+    recipient_name: str = ""
+    company: str = ""
+    job_title: str = ""
+    context: str = ""
+    
+    @model_validator(mode="before")
+    @classmethod
+    def accept_short_names(cls, data):
+        """CSV exports usually say `name` rather than `recipient_name`"""
+        if isinstance(data, dict) and "name" in data and "recipient_name" not in data:
+            data = {**data, "recipient_name": data["name"]}
+        return data
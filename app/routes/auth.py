@@ -1,27 +1,37 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from datetime import datetime, timedelta
 import jwt
-import bcrypt
-from pymongo import MongoClient
 from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError
 
 from app.config import settings
+from app.dependencies import get_users_collection, password_hasher
 from app.models.user_model import UserCreate, UserLogin, TokenResponse, UserResponse
+from app.services.password_hasher import HashingPoolSaturated
 
 router = APIRouter()
 
-# MongoDB connection
-client = MongoClient(settings.mongodb_uri)
-db = client[settings.mongodb_db]
-users_collection = db["users"]
+async def hash_password(password: str) -> str:
+    """Hash password with bcrypt on the hashing pool"""
+    try:
+        return await password_hasher.hash(password)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
 
-def hash_password(password: str) -> str:
-    """Hash password with bcrypt"""
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+async def verify_password(password: str, hash_password: str) -> bool:
+    """Verify password against hash on the hashing pool"""
+    try:
+        return await password_hasher.verify(password, hash_password)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
 
-def verify_password(password: str, hash_password: str) -> bool:
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode(), hash_password.encode())
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in requests, please retry shortly",
+        headers={"Retry-After": str(settings.password_hash_retry_after_seconds)}
+    )
 
 def create_access_token(user_id: str, expires_delta: timedelta = None):
     """Create JWT token"""
@@ -37,11 +47,14 @@ def create_access_token(user_id: str, expires_delta: timedelta = None):
     return encoded_jwt
 
 @router.post("/register", response_model=TokenResponse)
-async def register(user: UserCreate):
+async def register(
+    user: UserCreate,
+    users_collection: AsyncIOMotorCollection = Depends(get_users_collection)
+):
     """Register new user"""
     
     # Check if user exists
-    existing_user = users_collection.find_one({"email": user.email})
+    existing_user = await users_collection.find_one({"email": user.email}, {"_id": 1})
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -51,14 +64,21 @@ async def register(user: UserCreate):
     # Create new user
     new_user = {
         "email": user.email,
-        "password_hash": hash_password(user.password),
+        "password_hash": await hash_password(user.password),
         "plan": "FREE",
         "daily_requests": 0,
         "last_request_date": None,
         "created_at": datetime.utcnow()
     }
     
-    result = users_collection.insert_one(new_user)
+    try:
+        result = await users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration (unique email index)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     user_id = result.inserted_id
     
     # Create token
@@ -77,12 +97,18 @@ async def register(user: UserCreate):
     }
 
 @router.post("/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
+async def login(
+    credentials: UserLogin,
+    users_collection: AsyncIOMotorCollection = Depends(get_users_collection)
+):
     """Login user"""
     
     # Find user
-    user = users_collection.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    user = await users_collection.find_one(
+        {"email": credentials.email},
+        {"email": 1, "password_hash": 1, "plan": 1, "daily_requests": 1, "created_at": 1}
+    )
+    if not user or not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
@@ -104,11 +130,17 @@ async def login(credentials: UserLogin):
     }
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user(user_id: str):
+async def get_current_user(
+    user_id: str,
+    users_collection: AsyncIOMotorCollection = Depends(get_users_collection)
+):
     """Get current user info"""
     from app.middleware.rate_limiter import get_current_user
     
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await users_collection.find_one(
+        {"_id": ObjectId(user_id)},
+        {"email": 1, "plan": 1, "daily_requests": 1, "created_at": 1}
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
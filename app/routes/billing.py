@@ -1,19 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from bson import ObjectId
-from pymongo import MongoClient
 
 from app.config import settings
+from app.dependencies import get_subscription_service
 from app.middleware.rate_limiter import get_current_user
 from app.services.subscription_service import SubscriptionService
 from app.models.user_model import QuotaStatus, PlanUpgrade
 
 router = APIRouter()
-subscription_service = SubscriptionService()
 
 @router.get("/quota", response_model=QuotaStatus)
-async def get_quota(user: dict = Depends(get_current_user)):
+async def get_quota(
+    user_id: str = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service)
+):
     """Get user's quota status"""
+    user = await subscription_service.get_user(user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
     quota_status = await subscription_service.get_quota_status(user)
     return quota_status
 
@@ -50,7 +59,11 @@ async def get_plans():
     }
 
 @router.post("/upgrade")
-async def upgrade_plan(upgrade: PlanUpgrade, user_id: str = Depends(get_current_user)):
+async def upgrade_plan(
+    upgrade: PlanUpgrade,
+    user_id: str = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service)
+):
     """Upgrade user plan"""
     
     success = await subscription_service.upgrade_plan(user_id, upgrade.new_plan)
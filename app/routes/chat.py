@@ -1,18 +1,34 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from pydantic import BaseModel
-from app.services.memory_service import MemoryService
+from fastapi import APIRouter, HTTPException, Request, status, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from typing import List, Optional
+import asyncio
+import json
+
+from app.config import settings
+from app.dependencies import get_model_loader, get_subscription_service, get_template_service, memory_service
+from app.models.recipient_model import Recipient
+from app.services.bitnet_loader import BitNetLoader
 from app.services.mail_generator import MailGenerator
-from app.middleware.rate_limiter import increment_usage
+from app.services.memory_service import CHAT_ID_PATTERN, ChatNotFoundError
+from app.services.recipient_reader import CONTENT_TYPES, RecipientBatches, UploadTooLarge, content_type, spool_body
+from app.middleware.rate_limiter import generation_slot, get_current_user, increment_usage
+from app.services.admission_control import AdmissionSlot
 from app.services.subscription_service import SubscriptionService
+from app.services.template_registry import CompiledTemplate, TemplateError
+from app.services.template_service import TemplateService
 
 router = APIRouter()
 
 class ChatMessage(BaseModel):
-    chat_id: str
+    # Empty starts a new chat
+    chat_id: str = Field(pattern=f"^$|{CHAT_ID_PATTERN}")
     content: str
     recipient_name: str = ""
     company: str = ""
     job_title: str = ""
+    template: str = ""
 
 class ChatResponse(BaseModel):
     chat_id: str
@@ -20,29 +36,79 @@ class ChatResponse(BaseModel):
     generated_mail: dict
     quota_remaining: int
 
-memory_service = MemoryService()
 mail_generator = MailGenerator()
 
+async def load_template(template_service: TemplateService, user_id: str, name: str) -> Optional[CompiledTemplate]:
+    """Compiled user template by name, or None for the built-in one"""
+    if not name:
+        return None
+    try:
+        template = await template_service.load(user_id, name)
+    except TemplateError as e:
+        # Saved before templates were trial-rendered
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if template is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Template '{name}' not found")
+    return template
+
+async def render_mail(request: ChatMessage, template: Optional[CompiledTemplate]) -> dict:
+    """Template mail for a chat message; a template that fails on this data is the client's error"""
+    try:
+        return await mail_generator.generate_cold_mail(
+            recipient_name=request.recipient_name,
+            company=request.company,
+            job_title=request.job_title,
+            context=request.content,
+            template=template
+        )
+    except TemplateError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+async def existing_chat(request: ChatMessage, user_id: str = Depends(get_current_user)):
+    """404 for a message to an unknown chat, before any quota is charged"""
+    if request.chat_id and await memory_service.get_chat(user_id, request.chat_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+
+async def add_message(user_id: str, chat_id: str, role: str, content: str):
+    """Store a chat message; a chat deleted in the meantime is a 404"""
+    try:
+        await memory_service.add_message(user_id, chat_id, role, content)
+    except ChatNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+
+def stream_holding(frames, slot: AdmissionSlot) -> StreamingResponse:
+    """NDJSON response that keeps the generation slot until the stream ends"""
+    slot.hand_off()
+    
+    async def held():
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            slot.release()
+    
+    # The background task also covers a client that disconnects before the first frame
+    return StreamingResponse(held(), media_type="application/x-ndjson", background=BackgroundTask(slot.release))
+
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     request: ChatMessage,
-    user: dict = Depends(increment_usage)
+    _: None = Depends(existing_chat),
+    user: dict = Depends(increment_usage),
+    subscription_service: SubscriptionService = Depends(get_subscription_service),
+    template_service: TemplateService = Depends(get_template_service)
 ):
     """Send chat message and generate outreach email"""
     
     user_id = str(user["_id"])
+    template = await load_template(template_service, user_id, request.template)
     chat_id = request.chat_id or await memory_service.create_chat(user_id)
     
     # Add user message to memory
-    await memory_service.add_message(user_id, chat_id, "user", request.content)
+    await add_message(user_id, chat_id, "user", request.content)
     
     # Generate cold mail
-    mail = await mail_generator.generate_cold_mail(
-        recipient_name=request.recipient_name,
-        company=request.company,
-        job_title=request.job_title,
-        context=request.content
-    )
+    mail = await render_mail(request, template)
     
     # Get context for model
     context = await memory_service.get_context(user_id, chat_id)
@@ -52,10 +118,9 @@ async def send_message(
     response_text = f"Generated outreach for {request.recipient_name} at {request.company}"
     
     # Add assistant message to memory
-    await memory_service.add_message(user_id, chat_id, "assistant", response_text)
+    await add_message(user_id, chat_id, "assistant", response_text)
     
     # Get quota status
-    subscription_service = SubscriptionService()
     quota_status = await subscription_service.get_quota_status(user)
     
     return {
@@ -65,6 +130,185 @@ async def send_message(
         "quota_remaining": quota_status["remaining"]
     }
 
+@router.post("/message/stream")
+async def stream_message(
+    request: ChatMessage,
+    _: None = Depends(existing_chat),
+    slot: AdmissionSlot = Depends(generation_slot),
+    user: dict = Depends(increment_usage),
+    model_loader: BitNetLoader = Depends(get_model_loader),
+    subscription_service: SubscriptionService = Depends(get_subscription_service),
+    template_service: TemplateService = Depends(get_template_service)
+):
+    """Send chat message and stream the reply as NDJSON frames"""
+    
+    user_id = str(user["_id"])
+    template = await load_template(template_service, user_id, request.template)
+    chat_id = request.chat_id or await memory_service.create_chat(user_id)
+    
+    # Add user message to memory
+    await add_message(user_id, chat_id, "user", request.content)
+    
+    mail = await render_mail(request, template)
+    
+    context = await memory_service.get_context(user_id, chat_id)
+    prompt = f"{context}ASSISTANT:"
+    
+    async def frames():
+        chunks = []
+        try:
+            async for chunk in model_loader.stream(
+                prompt,
+                max_new_tokens=settings.chat_max_new_tokens,
+                stop=MailGenerator.stop_sequences["chat"],
+                cache_key=f"{user_id}:{chat_id}"
+            ):
+                chunks.append(chunk)
+                yield json.dumps({"type": "token", "text": chunk}) + "\n"
+        except Exception as e:
+            # The response has already started, so the failure goes in a final frame; the partial reply is not saved
+            print(f"Stream generation error: {e}")
+            yield json.dumps({"type": "error", "chat_id": chat_id, "detail": f"Unable to generate response: {e}"}) + "\n"
+            return
+        
+        response_text = "".join(chunks).strip()
+        
+        # Persist the assistant reply once, after the stream completes
+        try:
+            await memory_service.add_message(user_id, chat_id, "assistant", response_text)
+        except ChatNotFoundError:
+            # Deleted while the reply was streaming
+            pass
+        
+        quota_status = await subscription_service.get_quota_status(user)
+        
+        yield json.dumps({
+            "type": "done",
+            "chat_id": chat_id,
+            "message": response_text,
+            "generated_mail": mail,
+            "quota_remaining": quota_status["remaining"]
+        }) + "\n"
+    
+    return stream_holding(frames(), slot)
+
+async def _generate_row(
+    index: int,
+    recipient: Recipient,
+    model_loader: BitNetLoader,
+    mail: dict,
+    priority: int
+) -> dict:
+    try:
+        result = await mail_generator.generate_outreach(recipient, model_loader, mail=mail, priority=priority)
+    except Exception as e:
+        return {"type": "failed", "index": index, "error": str(e)}
+    return {"type": "result", "index": index, **result}
+
+@router.post("/bulk")
+async def bulk_generate(
+    request: Request,
+    slot: AdmissionSlot = Depends(generation_slot),
+    user_id: str = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service),
+    model_loader: BitNetLoader = Depends(get_model_loader),
+    template_service: TemplateService = Depends(get_template_service),
+    template: str = ""
+):
+    """Generate cold mails for a CSV / NDJSON / JSON list of recipients, streamed as NDJSON
+    
+    Rows are read, charged and generated one batch at a time, so memory stays
+    bounded by the batch size. Quota is charged once per batch; when it runs
+    out the remaining rows are reported as skipped.
+    """
+    kind = content_type(request)
+    if kind not in CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Send recipients as one of: {', '.join(CONTENT_TYPES)}"
+        )
+    
+    compiled_template = await load_template(template_service, user_id, template)
+    try:
+        body = await spool_body(request, settings.bulk_max_upload_bytes)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    
+    async def frames():
+        state = {"rows": 0, "exhausted": False, "quota_status": None}
+        batch: List[Recipient] = []
+        
+        async def run_batch():
+            start = state["rows"] - len(batch)
+            user, granted = await subscription_service.reserve_bulk(user_id, len(batch))
+            if user:
+                state["quota_status"] = await subscription_service.get_quota_status(user)
+            state["exhausted"] = granted < len(batch)
+            
+            try:
+                mails = mail_generator.render_batch(batch[:granted], compiled_template)
+            except TemplateError as e:
+                # Fails on this data: report the rows instead of breaking the stream
+                mails = []
+                for i in range(granted):
+                    yield json.dumps({"type": "failed", "index": start + i, "error": str(e)}) + "\n"
+            
+            # Rows finish in whatever order the model batches them
+            tasks = [
+                asyncio.create_task(_generate_row(start + i, recipient, model_loader, mail, slot.priority))
+                for i, (recipient, mail) in enumerate(zip(batch, mails))
+            ]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield json.dumps(await task) + "\n"
+            finally:
+                # Client gone: stop generating the rows nobody will read
+                for task in tasks:
+                    task.cancel()
+            
+            for i in range(granted, len(batch)):
+                yield json.dumps({"type": "skipped", "index": start + i, "reason": "quota_exceeded"}) + "\n"
+            batch.clear()
+        
+        error = None
+        reader = RecipientBatches(body, kind)
+        try:
+            while not error:
+                recipients, parse_error = await reader.read(settings.bulk_batch_size)
+                if parse_error:
+                    # Malformed JSON/CSV stops reading; rows before it are still generated
+                    error = {"type": "error", "index": state["rows"] + len(recipients), "detail": str(parse_error)}
+                elif not recipients:
+                    break
+                
+                for recipient in recipients:
+                    state["rows"] += 1
+                    if state["exhausted"]:
+                        yield json.dumps({"type": "skipped", "index": state["rows"] - 1, "reason": "quota_exceeded"}) + "\n"
+                        continue
+                    
+                    batch.append(recipient)
+                    if len(batch) >= settings.bulk_batch_size:
+                        async for frame in run_batch():
+                            yield frame
+        finally:
+            reader.close()
+        
+        if batch:
+            async for frame in run_batch():
+                yield frame
+        if error:
+            yield json.dumps(error) + "\n"
+        
+        quota_status = state["quota_status"]
+        yield json.dumps({
+            "type": "done",
+            "rows": state["rows"],
+            "quota_remaining": quota_status["remaining"] if quota_status else 0
+        }) + "\n"
+    
+    return stream_holding(frames(), slot)
+
 @router.post("/create-chat")
 async def create_chat(user: dict = Depends(increment_usage)):
     """Create new chat session"""
@@ -1,10 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from app.services.memory_service import MemoryService
+from app.dependencies import memory_service
 from app.middleware.rate_limiter import get_current_user
 from bson import ObjectId
 
 router = APIRouter()
-memory_service = MemoryService()
 
 @router.get("/chats")
 async def list_chats(user_id: str = Depends(get_current_user)):
@@ -0,0 +1,105 @@
+from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional
+import json
+
+from app.config import settings
+from app.dependencies import get_subscription_service, get_template_service, job_queue
+from app.models.recipient_model import Recipient
+from app.middleware.rate_limiter import get_current_user
+from app.services.subscription_service import SubscriptionService
+from app.services.template_registry import TemplateError
+from app.services.template_service import TemplateService
+
+router = APIRouter()
+
+class CampaignRequest(BaseModel):
+    recipients: List[Recipient]
+    tone: Optional[str] = None
+    template: str = ""
+    context: str = ""
+
+class JobSubmitted(BaseModel):
+    job_id: str
+    queued: int
+    skipped: int
+    quota_remaining: int
+
+async def _owned_job(job_id: str, user_id: str) -> dict:
+    job = await job_queue.get(job_id)
+    if not job or job["user_id"] != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@router.post("", response_model=JobSubmitted, status_code=status.HTTP_202_ACCEPTED)
+async def submit_campaign(
+    request: CampaignRequest,
+    user_id: str = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service),
+    template_service: TemplateService = Depends(get_template_service)
+):
+    """Queue a campaign for background generation
+    
+    Quota is charged for the whole campaign up front; recipients beyond the
+    remaining quota are dropped and reported as skipped.
+    """
+    if len(request.recipients) > settings.job_max_recipients:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A campaign can have at most {settings.job_max_recipients} recipients"
+        )
+    
+    template = None
+    if request.template:
+        template = await template_service.get_source(user_id, request.template)
+        if not template:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Template '{request.template}' not found")
+        try:
+            # Saved before templates were trial-rendered: reject now, not row by row
+            template_service.registry.compile(template["subject"], template["body"])
+        except TemplateError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    user, granted = await subscription_service.reserve_bulk(user_id, len(request.recipients))
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if request.recipients and not granted:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Daily quota exceeded. Upgrade your plan for more requests.",
+            headers={"X-Quota-Exceeded": "true"}
+        )
+    
+    # Campaign context fills in for recipients that don't bring their own
+    recipients = [
+        r if r.context or not request.context else r.model_copy(update={"context": request.context})
+        for r in request.recipients[:granted]
+    ]
+    job_id = await job_queue.submit(user_id, recipients, request.tone, template)
+    quota_status = await subscription_service.get_quota_status(user)
+    
+    return {
+        "job_id": job_id,
+        "queued": len(recipients),
+        "skipped": len(request.recipients) - len(recipients),
+        "quota_remaining": quota_status["remaining"]
+    }
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(get_current_user)):
+    """Job progress, throughput and ETA"""
+    job = await _owned_job(job_id, user_id)
+    job.pop("user_id")
+    return job
+
+@router.get("/{job_id}/results")
+async def get_job_results(job_id: str, user_id: str = Depends(get_current_user)):
+    """Finished rows so far, streamed as NDJSON in input order"""
+    await _owned_job(job_id, user_id)
+    
+    async def frames():
+        async for row in job_queue.results(job_id):
+            yield json.dumps(row) + "\n"
+    
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
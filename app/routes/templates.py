@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, status, Depends
+from pydantic import BaseModel, Field
+
+from app.dependencies import get_template_service
+from app.middleware.rate_limiter import get_current_user
+from app.services.template_registry import PLACEHOLDERS, TemplateError
+from app.services.template_service import TemplateService
+
+router = APIRouter()
+
+class TemplateRequest(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    subject: str
+    body: str
+
+@router.get("")
+async def list_templates(
+    user_id: str = Depends(get_current_user),
+    template_service: TemplateService = Depends(get_template_service)
+):
+    """List the user's mail templates"""
+    templates = await template_service.list_templates(user_id)
+    return {"templates": templates, "placeholders": sorted(PLACEHOLDERS)}
+
+@router.post("", status_code=status.HTTP_201_CREATED)
+async def save_template(
+    request: TemplateRequest,
+    user_id: str = Depends(get_current_user),
+    template_service: TemplateService = Depends(get_template_service)
+):
+    """Create or replace a mail template (placeholders are checked here, not at send time)"""
+    try:
+        return await template_service.save(user_id, request.name, request.subject, request.body)
+    except TemplateError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.delete("/{name}")
+async def delete_template(
+    name: str,
+    user_id: str = Depends(get_current_user),
+    template_service: TemplateService = Depends(get_template_service)
+):
+    """Delete a mail template"""
+    if not await template_service.delete(user_id, name):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Template not found")
+    return {"message": "Template deleted"}
@@ -0,0 +1,173 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict
+
+@dataclass
+class PlanClass:
+    """Admission limits for one subscription plan"""
+    priority: int
+    concurrency: int
+    queue_limit: int
+    active: int = 0
+    waiters: Deque[asyncio.Future] = field(default_factory=deque)
+    admitted: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+
+class GenerationRejected(Exception):
+    """Raised when a generation request is not admitted
+    
+    `queue_full` means the plan already has as many requests waiting as it
+    may (answer 429); otherwise the request waited `timeout` seconds without
+    getting a slot (answer 503). Either way `retry_after` is an estimate of
+    when a slot should be free.
+    """
+    
+    def __init__(self, plan: str, queue_full: bool, retry_after: int):
+        super().__init__(f"{plan} generation queue {'is full' if queue_full else 'timed out'}")
+        self.plan = plan
+        self.queue_full = queue_full
+        self.retry_after = retry_after
+
+class AdmissionSlot:
+    """A granted generation slot
+    
+    A streamed response keeps its slot until the stream ends, so ownership
+    can be handed from the request to the response; release() only acts once.
+    """
+    
+    def __init__(self, controller: "AdmissionController", plan: str):
+        self.controller = controller
+        self.plan = plan
+        self.priority = controller.priority(plan)
+        self.started = time.monotonic()
+        self.handed_off = False
+        self.released = False
+    
+    def hand_off(self) -> "AdmissionSlot":
+        self.handed_off = True
+        return self
+    
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.plan, time.monotonic() - self.started)
+
+class AdmissionController:
+    """Bounds model generation requests per plan and admits waiters by plan priority
+    
+    At most `concurrency` requests generate at once over all plans, and each
+    plan has its own concurrency and queue limit on top. When a slot frees
+    up it goes to the waiting request of the highest-priority plan that is
+    under its own limit, so a burst on one plan cannot hold back another.
+    Requests beyond a plan's queue limit are rejected at once instead of
+    piling up.
+    """
+    
+    def __init__(
+        self,
+        priorities: Dict[str, int],
+        plan_concurrency: Dict[str, int],
+        plan_queue: Dict[str, int],
+        concurrency: int = 16,
+        timeout_seconds: float = 30
+    ):
+        self.classes = {
+            plan: PlanClass(priority, max(1, plan_concurrency.get(plan, 1)), max(0, plan_queue.get(plan, 0)))
+            for plan, priority in priorities.items()
+        }
+        self.order = sorted(self.classes, key=lambda plan: self.classes[plan].priority)
+        # Plans missing from the table are treated like the lowest one
+        self.default_plan = self.order[-1]
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout_seconds
+        self.active = 0
+        # Moving average of how long a request holds its slot, for Retry-After
+        self.hold_seconds = 1.0
+    
+    def plan_class(self, plan: str) -> str:
+        return plan if plan in self.classes else self.default_plan
+    
+    def priority(self, plan: str) -> int:
+        return self.classes[self.plan_class(plan)].priority
+    
+    def _retry_after(self, plan_class: PlanClass) -> int:
+        ahead = len(plan_class.waiters) + 1
+        return max(1, math.ceil(self.hold_seconds * ahead / plan_class.concurrency))
+    
+    def _dispatch(self):
+        """Hand free slots to waiters, highest priority first"""
+        for plan in self.order:
+            plan_class = self.classes[plan]
+            while plan_class.waiters and self.active < self.concurrency and plan_class.active < plan_class.concurrency:
+                waiter = plan_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                self.active += 1
+                plan_class.active += 1
+                waiter.set_result(None)
+    
+    async def acquire(self, plan: str):
+        """Wait for a generation slot; raises GenerationRejected"""
+        name = self.plan_class(plan)
+        plan_class = self.classes[name]
+        
+        if not plan_class.waiters and self.active < self.concurrency and plan_class.active < plan_class.concurrency:
+            self.active += 1
+            plan_class.active += 1
+            plan_class.admitted += 1
+            return
+        
+        if len(plan_class.waiters) >= plan_class.queue_limit:
+            plan_class.rejected += 1
+            raise GenerationRejected(name, True, self._retry_after(plan_class))
+        
+        waiter = asyncio.get_running_loop().create_future()
+        plan_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we gave up: pass the slot on
+                self.release(name)
+            elif waiter in plan_class.waiters:
+                plan_class.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                plan_class.timed_out += 1
+                raise GenerationRejected(name, False, self._retry_after(plan_class))
+            raise
+        plan_class.admitted += 1
+    
+    def release(self, plan: str, held_seconds: float = 0.0):
+        plan_class = self.classes[self.plan_class(plan)]
+        self.active -= 1
+        plan_class.active -= 1
+        if held_seconds:
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * held_seconds
+        self._dispatch()
+    
+    async def hold(self, plan: str) -> "AdmissionSlot":
+        """Acquire a slot that is given back with AdmissionSlot.release()"""
+        await self.acquire(plan)
+        return AdmissionSlot(self, plan)
+    
+    @property
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "concurrency": self.concurrency,
+            "hold_seconds": round(self.hold_seconds, 2),
+            "plans": {
+                plan: {
+                    "active": c.active,
+                    "waiting": len(c.waiters),
+                    "admitted": c.admitted,
+                    "rejected": c.rejected,
+                    "timed_out": c.timed_out
+                }
+                for plan, c in self.classes.items()
+            }
+        }
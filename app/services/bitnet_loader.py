@@ -1,138 +1,502 @@
-import os
+import copy
+import shutil
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, List, Dict, Any, AsyncIterator, Sequence
 import asyncio
 
+from app.services.cancellation import CancelToken, StopWhenCancelled
+from app.services.context_builder import approximate_tokens
+from app.services.generation_scheduler import GenerationRequest, GenerationScheduler
+from app.services.model_backends import MockBackend, cache_lock, create_backend
+from app.services.prefix_cache import PrefixCache
+from app.services.response_cache import ResponseCache
+from app.services.speculative import SpeculativeDecoder
+from app.services.stop_sequences import StopOnSequences, truncate_at_stop
+from app.services.token_streamer import BatchStreamer
+
 class BitNetLoader:
     """Service for loading and caching BitNet model"""
     
     def __init__(self, settings):
         self.settings = settings
         self.model = None
+        # Used only by the scheduler thread; the event loop counts and decodes with its own copy
         self.tokenizer = None
+        self.loop_tokenizer = None
         self.model_loaded = False
+        # idle -> loading -> warming -> ready (or failed)
+        self.state = "idle"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._startup: Optional[asyncio.Task] = None
+        self.backend = create_backend(settings)
+        self.scheduler = GenerationScheduler(
+            self._run_batch,
+            max_batch_size=settings.generation_max_batch_size,
+            max_wait_ms=settings.generation_max_wait_ms
+        )
+        self.prefix_cache = PrefixCache(settings.kv_cache_max_bytes)
+        self.speculative: Optional[SpeculativeDecoder] = None
+        # Model runs cut short because nobody was waiting for them any more
+        self.aborted_runs = 0
+        # Greedy decoding makes outputs repeatable, which is what lets them be cached
+        if settings.generation_deterministic:
+            self.sampling = {"do_sample": False}
+            self.response_cache = ResponseCache(
+                f"{settings.model_name}:{self.backend.name}",
+                settings.response_cache_size,
+                settings.response_cache_db_path,
+                settings.response_cache_disk_entries
+            )
+        else:
+            self.sampling = {"do_sample": True, "temperature": 0.7, "top_p": 0.9}
+            self.response_cache = None
+    
+    def start(self) -> asyncio.Task:
+        """Load and warm the model in the background (idempotent)"""
+        if self._startup is None:
+            self._startup = asyncio.create_task(self._load_and_warm())
+        return self._startup
+    
+    async def _load_and_warm(self):
+        started = time.monotonic()
+        try:
+            self.state = "loading"
+            if not self.model_loaded:
+                await self.initialize()
+            self.state = "warming"
+            await self.warm_up()
+            self.state = "ready"
+            self.load_seconds = round(time.monotonic() - started, 2)
+            print(f"✅ Model warmed up, ready after {self.load_seconds}s")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+    
+    async def warm_up(self):
+        """Run a few throwaway generations so kernels and buffers are allocated before real traffic"""
+        prompts = ["USER: Hello\nASSISTANT:", "USER: Write a short email\nASSISTANT:"]
+        stop = ("\nUSER:",)
+        for _ in range(self.settings.model_warmup_runs):
+            # Two prompts at once also exercise the padded batch path
+            await asyncio.gather(*(self.scheduler.submit(p, max_new_tokens=8, stop=stop) for p in prompts))
+        if self._use_prefix_cache("warmup"):
+            # Chat turns take the single-sequence cached path instead
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lambda: self._generate_cached(prompts[0], "warmup", stop=stop, max_new_tokens=8))
+            self.prefix_cache.discard("warmup")
+    
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+    
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the background load; False if it failed or did not finish in time"""
+        task = self.start()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.ready
+    
+    @property
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "backend": self.backend.name,
+            "mock": bool(self._is_mock()),
+            "load_seconds": self.load_seconds,
+            "aborted_runs": self.aborted_runs,
+            "error": self.error
+        }
     
     async def initialize(self):
         """Initialize model loading"""
         try:
-            # Create cache directory
-            cache_dir = Path(self.settings.model_cache_dir)
-            cache_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Check if model exists locally
-            model_path = cache_dir / "bitnet_model"
-            
-            if model_path.exists():
-                print(f"📦 Loading cached model from {model_path}")
-                await self._load_from_cache(model_path)
+            if not self.backend.needs_weights:
+                self.model, self.tokenizer, self.loop_tokenizer = self._load_model("")
             else:
-                print(f"📥 Downloading model {self.settings.model_name}")
-                await self._download_model(cache_dir)
+                # Create cache directory
+                cache_dir = Path(self.settings.model_cache_dir)
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                
+                # Check if model exists locally
+                model_path = cache_dir / "bitnet_model"
+                
+                if model_path.exists() or await self._download_model(model_path):
+                    print(f"📦 Loading cached model from {model_path} ({self.backend.name} backend)")
+                    await self._load_from_cache(model_path)
+                
+                if self.settings.draft_model_name and not self._is_mock():
+                    await self._load_draft(cache_dir / "draft_model")
             
             self.model_loaded = True
-            print("✅ BitNet model ready")
+            self.scheduler.start()
+            print("✅ BitNet model loaded")
         except Exception as e:
             print(f"❌ Error loading model: {e}")
             raise
     
-    async def _download_model(self, cache_dir: Path):
-        """Download model from Hugging Face"""
+    async def _download_model(self, model_path: Path) -> bool:
+        """Download model files from Hugging Face into the local cache"""
         try:
-            # This is a placeholder - actual implementation would use transformers
-            from transformers import AutoTokenizer, AutoModelForCausalLM
-            
-            model_name = self.settings.model_name
-            
-            # Set Hugging Face token if available
-            if self.settings.hf_token:
-                os.environ["HF_TOKEN"] = self.settings.hf_token
-            
-            # Run in thread pool to avoid blocking
             loop = asyncio.get_event_loop()
-            self.tokenizer = await loop.run_in_executor(
-                None,
-                lambda: AutoTokenizer.from_pretrained(model_name)
-            )
-            
-            self.model = await loop.run_in_executor(
-                None,
-                lambda: AutoModelForCausalLM.from_pretrained(
-                    model_name,
-                    cache_dir=str(cache_dir),
-                    device_map="auto"
-                )
-            )
-            
-            # Save locally
-            model_path = cache_dir / "bitnet_model"
-            model_path.mkdir(exist_ok=True)
-            
-            self.model.save_pretrained(str(model_path))
-            self.tokenizer.save_pretrained(str(model_path))
-            
+            await loop.run_in_executor(None, lambda: self._download_files(self.settings.model_name, model_path))
+            return True
         except Exception as e:
             print(f"⚠️ Model download failed, using mock model: {e}")
             self._setup_mock_model()
+            return False
+    
+    def _download_files(self, repo_id: str, model_path: Path):
+        """Download under the cache lock, so concurrent workers fetch the model once"""
+        from huggingface_hub import snapshot_download
+        
+        with cache_lock(model_path):
+            if model_path.exists():
+                return  # another worker finished it while we waited
+            print(f"📥 Downloading model {repo_id}")
+            # Into a side directory: model_path only appears once it is complete
+            partial = model_path.with_name(model_path.name + ".partial")
+            try:
+                # Files only: the selected backend decides how to load them
+                snapshot_download(
+                    repo_id,
+                    local_dir=str(partial),
+                    # Real files, not symlinks into ~/.cache/huggingface (missing in other containers)
+                    local_dir_use_symlinks=False,
+                    token=self.settings.hf_token or None
+                )
+                partial.rename(model_path)
+            finally:
+                shutil.rmtree(partial, ignore_errors=True)
     
     async def _load_from_cache(self, model_path: Path):
         """Load model from cache"""
         try:
-            from transformers import AutoTokenizer, AutoModelForCausalLM
-            
-            self.tokenizer = AutoTokenizer.from_pretrained(str(model_path))
-            self.model = AutoModelForCausalLM.from_pretrained(
-                str(model_path),
-                device_map="auto"
+            # Run in thread pool to avoid blocking
+            loop = asyncio.get_event_loop()
+            self.model, self.tokenizer, self.loop_tokenizer = await loop.run_in_executor(
+                None,
+                lambda: self._load_model(str(model_path))
             )
         except Exception as e:
             print(f"⚠️ Cache load failed, using mock model: {e}")
             self._setup_mock_model()
     
+    async def _load_draft(self, draft_path: Path):
+        """Load the draft model for speculative decoding; generation works without it"""
+        try:
+            loop = asyncio.get_event_loop()
+            if not draft_path.exists():
+                await loop.run_in_executor(None, lambda: self._download_files(self.settings.draft_model_name, draft_path))
+            draft, draft_tokenizer = await loop.run_in_executor(None, lambda: self.backend.load(str(draft_path)))
+            # The main model verifies the draft's token ids, so both must use one vocabulary
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                print(f"⚠️ Draft model {self.settings.draft_model_name} uses a different tokenizer, speculative decoding disabled")
+                return
+            self.speculative = SpeculativeDecoder(self.model, draft, self.settings.draft_num_tokens)
+            print(f"✅ Draft model {self.settings.draft_model_name} loaded for speculative decoding")
+        except Exception as e:
+            print(f"⚠️ Draft model unavailable, decoding without it: {e}")
+    
+    def _load_model(self, model_path: str):
+        """Model, tokenizer and a second tokenizer for the event loop
+        
+        A fast tokenizer must not be used from two threads at once: padded
+        batches switch padding on and off inside it, and an encode or decode
+        running alongside fails with "Already borrowed".
+        """
+        model, tokenizer = self.backend.load(model_path)
+        return model, tokenizer, copy.deepcopy(tokenizer)
+    
     def _setup_mock_model(self):
         """Setup mock model for development"""
-        self.model = {"mock": True}
-        self.tokenizer = {"mock": True}
+        self.model, self.tokenizer = MockBackend().load("")
+        self.loop_tokenizer = self.tokenizer
     
-    async def generate(self, prompt: str, max_length: int = 512) -> str:
-        """Generate text using BitNet"""
-        if not self.model_loaded:
-            await self.initialize()
-        
-        if isinstance(self.model, dict) and self.model.get("mock"):
+    def _is_mock(self) -> bool:
+        return isinstance(self.model, dict) and self.model.get("mock")
+    
+    @property
+    def tokenizer_id(self) -> str:
+        """Identifies the tokenizer that cached token counts belong to"""
+        return "approx" if self._is_mock() or self.loop_tokenizer is None else self.settings.model_name
+    
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens the model sees for this text (event loop only)"""
+        if self._is_mock() or self.loop_tokenizer is None:
+            return approximate_tokens(text)
+        return len(self.loop_tokenizer.encode(text, add_special_tokens=False))
+    
+    def _stopping_criteria(self, stop: Sequence[str], prompt_length: int, cancels: Sequence[CancelToken] = ()):
+        from transformers import StoppingCriteriaList
+        criteria = StoppingCriteriaList()
+        if stop:
+            criteria.append(StopOnSequences(self.tokenizer, stop, prompt_length))
+        if cancels:
+            criteria.append(StopWhenCancelled(cancels))
+        return criteria
+    
+    def _count_aborted(self, criteria):
+        if any(isinstance(c, StopWhenCancelled) and c.triggered for c in criteria):
+            self.aborted_runs += 1
+    
+    def _run_batch(self, requests: List[GenerationRequest]) -> List[str]:
+        """Run one batch through the model (called from the scheduler's executor)"""
+        prompts = [r.prompt for r in requests]
+        if self._is_mock():
             # Mock response for development
-            return f"Generated response for: {prompt[:50]}..."
+            return [f"Generated response for: {prompt[:50]}..." for prompt in prompts]
         
-        try:
-            loop = asyncio.get_event_loop()
-            
-            inputs = await loop.run_in_executor(
-                None,
-                lambda: self.tokenizer.encode(prompt, return_tensors="pt")
+        params = dict(requests[0].params)
+        stop = params.pop("stop", ())
+        cancels = [r.cancel for r in requests]
+        streamer = None
+        if any(r.on_tokens for r in requests):
+            streamer = BatchStreamer([r.on_tokens for r in requests])
+        
+        # A chat prompt on its own continues from its cached prefix
+        if len(requests) == 1 and self._use_prefix_cache(requests[0].cache_key):
+            tokens = self._generate_cached(
+                prompts[0],
+                requests[0].cache_key,
+                streamer=streamer,
+                stop=stop,
+                cancel=cancels[0],
+                **params
             )
-            
-            outputs = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate(
-                    inputs,
-                    max_length=max_length,
-                    temperature=0.7,
-                    top_p=0.9,
-                    do_sample=True
+            return [truncate_at_stop(self.tokenizer.decode(tokens, skip_special_tokens=True), stop)]
+        
+        # Decoder-only models need left padding so generation continues from real tokens
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        prompt_length = inputs["input_ids"].shape[1]
+        
+        # A batch already shares each forward pass; a lone prompt gets the draft model instead
+        generate = self.speculative.generate if self.speculative and len(prompts) == 1 else self.model.generate
+        criteria = self._stopping_criteria(stop, prompt_length, cancels)
+        outputs = generate(
+            inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            pad_token_id=self.tokenizer.pad_token_id,
+            streamer=streamer,
+            stopping_criteria=criteria,
+            **self.sampling,
+            **params
+        )
+        self._count_aborted(criteria)
+        
+        # Left padding lines every prompt up to the same length: decode only what follows
+        texts = self.tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
+        return [truncate_at_stop(text, stop) for text in texts]
+    
+    def _cached_prefill(self, cache_key: str, input_ids):
+        """Attention cache for all but the last prompt token, reusing the chat's cached prefix
+        
+        Only the tokens after the shared prefix go through the model here; the
+        result is stored for the chat's next turn.
+        """
+        import torch
+        
+        target = input_ids.shape[1] - 1
+        if target <= 0:
+            return None
+        
+        past, reused = self.prefix_cache.lookup(cache_key, input_ids[0, :target])
+        if reused < target:
+            with torch.no_grad():
+                outputs = self.model(input_ids[:, reused:target], past_key_values=past, use_cache=True)
+            past = outputs.past_key_values
+            if hasattr(past, "to_legacy_cache"):
+                past = past.to_legacy_cache()
+            self.prefix_cache.prefilled_tokens += target - reused
+        
+        self.prefix_cache.store(cache_key, input_ids[0, :target], past)
+        return past
+    
+    def _generate_cached(
+        self,
+        prompt: str,
+        cache_key: str,
+        streamer=None,
+        stop: Sequence[str] = (),
+        cancel: Optional[CancelToken] = None,
+        **params
+    ):
+        """Single-prompt generation that continues from the chat's cached prefix; returns the new token ids"""
+        import torch
+        
+        input_ids = self.tokenizer.encode(prompt, return_tensors="pt")
+        if cancel and cancel.cancelled:
+            return input_ids[0, :0]
+        past = self._cached_prefill(cache_key, input_ids)
+        criteria = self._stopping_criteria(stop, input_ids.shape[1], [cancel] if cancel else ())
+        outputs = self.model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=past,
+            pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
+            streamer=streamer,
+            stopping_criteria=criteria,
+            **self.sampling,
+            **params
+        )
+        self._count_aborted(criteria)
+        return outputs[0, input_ids.shape[1]:]
+    
+    def _use_prefix_cache(self, cache_key: Optional[str]) -> bool:
+        return bool(cache_key) and self.prefix_cache.enabled and not self._is_mock()
+    
+    async def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int = 256,
+        stop: Sequence[str] = (),
+        cache_key: Optional[str] = None,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+        raise_errors: bool = False
+    ) -> str:
+        """Generate text using BitNet
+        
+        Returns only the generated continuation, cut before the first `stop`
+        sequence; decoding ends as soon as one is produced. Batched prompts
+        are scheduled by `priority` (lower first). A prompt with a
+        `cache_key` (a chat) that runs in a batch of its own reuses the
+        attention cache of that chat's previous prompt. In deterministic mode results come from
+        the response cache when the same request was seen before (or is
+        running right now).
+        
+        Generation gives up after `timeout` seconds (default
+        GENERATION_TIMEOUT_SECONDS, 0 = none); when it times out or the
+        caller is cancelled, the model stops decoding for this request.
+        
+        Failures come back as an "Unable to generate response" message
+        unless `raise_errors` is set, for callers that record failed rows.
+        """
+        params = {"max_new_tokens": max_new_tokens, "stop": tuple(stop)}
+        if timeout is None:
+            timeout = self.settings.generation_timeout_seconds
+        try:
+            if not await self.wait_ready():
+                raise RuntimeError(f"Model {self.state}: {self.error}")
+            if self.response_cache is None or self._is_mock():
+                generation = self._generate(prompt, params, cache_key, priority)
+            else:
+                generation = self.response_cache.get_or_generate(
+                    prompt,
+                    {**params, **self.sampling},
+                    lambda: self._generate(prompt, params, cache_key, priority)
                 )
-            )
-            
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            )
-            
-            return response
+            try:
+                return await asyncio.wait_for(generation, timeout or None)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"Generation timed out after {timeout}s") from None
         except Exception as e:
             print(f"Generation error: {e}")
+            if raise_errors:
+                raise
             return f"Unable to generate response: {str(e)}"
     
+    async def _generate(self, prompt: str, params: Dict[str, Any], cache_key: Optional[str], priority: int) -> str:
+        return await self.scheduler.submit(prompt, priority=priority, cache_key=cache_key, **params)
+    
+    async def stream(
+        self,
+        prompt: str,
+        max_new_tokens: int = 256,
+        stop: Sequence[str] = (),
+        cache_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Yield generated text chunks as the model produces them, ending before the first `stop` sequence
+        
+        The model stops decoding as soon as the consumer goes away (e.g. the
+        client disconnected) or GENERATION_TIMEOUT_SECONDS pass; in the
+        latter case the stream simply ends early.
+        """
+        if not await self.wait_ready():
+            raise RuntimeError(f"Model {self.state}: {self.error}")
+        
+        if self._is_mock():
+            for word in f"Generated response for: {prompt[:50]}...".split(" "):
+                yield word + " "
+                await asyncio.sleep(0)
+            return
+        
+        # The model thread hands over token ids; text is decoded here from all of them
+        # so characters split across tokens come out whole
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        cancel = CancelToken(self.settings.generation_timeout_seconds)
+        generation = asyncio.ensure_future(self.scheduler.submit(
+            prompt,
+            cancel=cancel,
+            cache_key=cache_key,
+            on_tokens=lambda ids: loop.call_soon_threadsafe(chunks.put_nowait, ids),
+            max_new_tokens=max_new_tokens,
+            stop=tuple(stop)
+        ))
+        # Wakes the reader when generation finishes or fails, whatever it streamed
+        generation.add_done_callback(lambda _: chunks.put_nowait(None))
+        
+        try:
+            # Text that could still turn out to be the start of a stop sequence is held back
+            hold = max((len(s) for s in stop), default=1) - 1
+            tokens: List[int] = []
+            sent = 0
+            pending = ""
+            while True:
+                ids = await chunks.get()
+                if ids is not None:
+                    tokens.extend(ids)
+                text = self.loop_tokenizer.decode(tokens, skip_special_tokens=True)
+                if ids is not None and text.endswith("\ufffd"):
+                    # Incomplete character; wait for the rest of its bytes
+                    continue
+                pending += text[sent:]
+                sent = len(text)
+                text = truncate_at_stop(pending, stop)
+                if len(text) < len(pending):
+                    pending = text
+                    break
+                if ids is None:
+                    # Generation ended: whatever was held back for a whole character goes out as is
+                    break
+                if len(pending) > hold:
+                    yield pending[:len(pending) - hold]
+                    pending = pending[len(pending) - hold:]
+            
+            try:
+                await generation
+            except asyncio.TimeoutError:
+                # Deadline passed before or during generation: end the stream early
+                pass
+            if pending:
+                yield pending
+        finally:
+            # Normally a no-op; on disconnect it ends the decode loop at the next token
+            cancel.cancel()
+            generation.cancel()
+    
     async def unload(self):
         """Unload model from memory"""
+        if self._startup and not self._startup.done():
+            self._startup.cancel()
+            try:
+                await self._startup
+            except asyncio.CancelledError:
+                pass
+        await self.scheduler.stop()
+        self.prefix_cache.clear()
+        self.speculative = None
+        if self.response_cache:
+            await self.response_cache.close()
         self.model = None
         self.tokenizer = None
+        self.loop_tokenizer = None
         self.model_loaded = False
\ No newline at end of file
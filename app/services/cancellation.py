@@ -0,0 +1,34 @@
+import threading
+import time
+from typing import Sequence
+
+class CancelToken:
+    """Lets the event loop tell a generation thread that its result is no longer wanted
+    
+    A token is cancelled explicitly (the client went away or its await was
+    cancelled) or implicitly once its deadline passes.
+    """
+    
+    def __init__(self, timeout: float = 0):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._event = threading.Event()
+    
+    def cancel(self):
+        self._event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+class StopWhenCancelled:
+    """Stopping criterion for `model.generate`: ends decoding once every request in the batch is cancelled"""
+    
+    def __init__(self, tokens: Sequence[CancelToken]):
+        self.tokens = tuple(tokens)
+        self.triggered = False
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        self.triggered = all(token.cancelled for token in self.tokens)
+        return self.triggered
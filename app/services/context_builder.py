@@ -0,0 +1,144 @@
+import re
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+# Used until a model tokenizer is attached: roughly four characters per token
+def approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class ApproximateCounter:
+    tokenizer_id = "approx"
+    
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return approximate_tokens(text)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+class ContextBuilder:
+    """Builds model prompts from the newest messages that fit a token budget
+    
+    Token counts are cached on each message under the tokenizer's id, so a
+    message is tokenized at most once per tokenizer. Building walks back from
+    the newest message and stops at the budget, so the cost does not depend
+    on how long the chat is.
+    
+    When a chat overflows the budget and `summary_tokens` is set, the turns
+    that slid out of the window are folded into a short extractive summary
+    that is prepended to the prompt. Summaries are kept per chat and only the
+    newly dropped turns are folded in on each call.
+    """
+    
+    SUMMARY_HEADER = "Earlier in this conversation:\n"
+    SUMMARY_LINE_CHARS = 160
+    
+    def __init__(self, max_tokens: int = 1024, summary_tokens: int = 0, max_summaries: int = 10000):
+        self.max_tokens = max(1, max_tokens)
+        self.summary_tokens = max(0, min(summary_tokens, self.max_tokens // 2))
+        self.max_summaries = max_summaries
+        self.counter = ApproximateCounter()
+        # (user_id, chat_id) -> {"tokenizer": str, "upto": int, "lines": [(text, tokens)], "tokens": int}
+        self.summaries: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self.tokenized = 0
+    
+    def use_tokenizer(self, counter):
+        """Count with `counter.count_tokens`, caching under `counter.tokenizer_id`
+        
+        Both are read on every call, so a model that finishes loading later
+        takes over from the approximation by itself.
+        """
+        self.counter = counter
+    
+    @property
+    def tokenizer_id(self) -> str:
+        return self.counter.tokenizer_id
+    
+    def count_tokens(self, text: str) -> int:
+        return self.counter.count_tokens(text)
+    
+    @staticmethod
+    def format_message(message: Dict) -> str:
+        return f"{message['role'].upper()}: {message['content']}\n"
+    
+    def message_tokens(self, message: Dict) -> int:
+        """Token count of a formatted message, cached on the message itself"""
+        counts = message.get("tokens")
+        if counts is None:
+            counts = message["tokens"] = {}
+        tokens = counts.get(self.tokenizer_id)
+        if tokens is None:
+            tokens = counts[self.tokenizer_id] = self.count_tokens(self.format_message(message))
+            self.tokenized += 1
+        return tokens
+    
+    def _window_start(self, messages: List[Dict], budget: int) -> int:
+        """Index of the oldest message in the newest run that fits the budget (always keeps the last one)"""
+        used = 0
+        start = len(messages)
+        while start > 0:
+            tokens = self.message_tokens(messages[start - 1])
+            if used + tokens > budget and start < len(messages):
+                break
+            used += tokens
+            start -= 1
+        return start
+    
+    def _summary_line(self, message: Dict) -> str:
+        first = _SENTENCE_END.split(message["content"].strip(), 1)[0]
+        if len(first) > self.SUMMARY_LINE_CHARS:
+            first = first[:self.SUMMARY_LINE_CHARS].rstrip() + "..."
+        return f"- {message['role']}: {first}\n"
+    
+    def _summary(self, key: Tuple[str, str], messages: List[Dict], start: int) -> str:
+        """Rolling summary of messages[:start], updated incrementally"""
+        summary = self.summaries.get(key)
+        if summary is None or summary["upto"] > start or summary["tokenizer"] != self.tokenizer_id:
+            summary = {"tokenizer": self.tokenizer_id, "upto": 0, "lines": [], "tokens": 0}
+        
+        # Every line costs at least one token, so older turns would be trimmed anyway
+        first = max(summary["upto"], start - self.summary_tokens)
+        for message in messages[first:start]:
+            line = self._summary_line(message)
+            tokens = self.count_tokens(line)
+            summary["lines"].append((line, tokens))
+            summary["tokens"] += tokens
+        summary["upto"] = start
+        
+        # Oldest turns fall out first
+        budget = self.summary_tokens - self.count_tokens(self.SUMMARY_HEADER)
+        drop = 0
+        while summary["tokens"] > budget and drop < len(summary["lines"]):
+            summary["tokens"] -= summary["lines"][drop][1]
+            drop += 1
+        if drop:
+            del summary["lines"][:drop]
+        
+        self.summaries[key] = summary
+        self.summaries.move_to_end(key)
+        while len(self.summaries) > self.max_summaries:
+            self.summaries.popitem(last=False)
+        
+        if not summary["lines"]:
+            return ""
+        return self.SUMMARY_HEADER + "".join(line for line, _ in summary["lines"])
+    
+    def build(self, key: Tuple[str, str], messages: List[Dict]) -> str:
+        """Prompt context for a chat: optional summary, then the newest messages in budget"""
+        start = self._window_start(messages, self.max_tokens)
+        summary = ""
+        if start > 0 and self.summary_tokens:
+            start = self._window_start(messages, self.max_tokens - self.summary_tokens)
+            summary = self._summary(key, messages, start)
+        
+        return summary + "".join(self.format_message(m) for m in messages[start:])
+    
+    def forget(self, key: Tuple[str, str]):
+        self.summaries.pop(key, None)
+    
+    @property
+    def stats(self) -> Dict:
+        return {
+            "tokenizer": self.tokenizer_id,
+            "tokenized_messages": self.tokenized,
+            "summaries": len(self.summaries)
+        }
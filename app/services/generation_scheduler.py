@@ -0,0 +1,174 @@
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.cancellation import CancelToken
+
+
+@dataclass
+class GenerationRequest:
+    """A single prompt waiting for a batch slot"""
+    prompt: str
+    params: Dict[str, Any]
+    future: asyncio.Future
+    priority: int = 0
+    cancel: CancelToken = field(default_factory=CancelToken)
+    # Chat whose attention cache a batch of one may continue from
+    cache_key: Optional[str] = None
+    # Called from the model thread with each new chunk of token ids, for streaming
+    on_tokens: Optional[Callable[[List[int]], None]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    
+    @property
+    def batch_key(self) -> tuple:
+        """Requests can only share a batch if their generation params match"""
+        return tuple(sorted(self.params.items()))
+
+
+class GenerationScheduler:
+    """Queues prompts and packs them into dynamic batches for the model
+    
+    The queue is ordered by priority (lower first), then arrival, so each
+    batch starts with the most urgent waiting prompt. When a caller stops
+    waiting, its request is dropped from the queue or, if it is already
+    generating, its cancel token is set so the batch can stop early.
+    
+    One batch runs at a time, and streamed requests go through the same
+    queue, so the model never runs several generations side by side.
+    """
+    
+    def __init__(
+        self,
+        run_batch: Callable[[List[GenerationRequest]], List[str]],
+        max_batch_size: int = 8,
+        max_wait_ms: int = 20
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        # (priority, arrival, request)
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._arrivals = itertools.count()
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"batches": 0, "requests": 0, "max_batch_seen": 0, "dropped": 0}
+    
+    def start(self):
+        """Start the background batching loop"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the batching loop and fail anything still queued or generating"""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        
+        while not self.queue.empty():
+            _, _, request = self.queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Generation scheduler stopped"))
+    
+    async def submit(
+        self,
+        prompt: str,
+        priority: int = 0,
+        cancel: Optional[CancelToken] = None,
+        cache_key: Optional[str] = None,
+        on_tokens: Optional[Callable[[List[int]], None]] = None,
+        **params
+    ) -> str:
+        """Queue a prompt and wait for its own result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        request = GenerationRequest(
+            prompt=prompt,
+            params=params,
+            future=future,
+            priority=priority,
+            cache_key=cache_key,
+            on_tokens=on_tokens
+        )
+        if cancel is not None:
+            request.cancel = cancel
+        await self.queue.put((priority, next(self._arrivals), request))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            request.cancel.cancel()
+            raise
+    
+    async def _collect_batch(self) -> List[GenerationRequest]:
+        """Wait for one request, then gather compatible ones until full or timed out"""
+        first = await self.queue.get()
+        batch = [first]
+        deferred = []
+        deadline = time.monotonic() + self.max_wait
+        
+        try:
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item[2].batch_key == first[2].batch_key:
+                    batch.append(item)
+                else:
+                    deferred.append(item)
+        except asyncio.CancelledError:
+            # Stopped while gathering: back in the queue, where stop() fails them
+            deferred.extend(batch)
+            raise
+        finally:
+            # Incompatible requests go back in line, keeping their place, for the next batch
+            for item in deferred:
+                self.queue.put_nowait(item)
+        
+        return [item[2] for item in batch]
+    
+    async def _run(self):
+        """Batching loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            collected = await self._collect_batch()
+            for request in collected:
+                if request.cancel.cancelled and not request.future.done():
+                    request.future.set_exception(asyncio.TimeoutError("Generation deadline passed while queued"))
+            batch = [r for r in collected if not r.future.done()]
+            self.stats["dropped"] += len(collected) - len(batch)
+            if not batch:
+                continue
+            
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+            
+            try:
+                outputs = await loop.run_in_executor(
+                    None,
+                    lambda: self.run_batch(batch)
+                )
+            except asyncio.CancelledError:
+                # Stopped mid-batch: the model thread is told to stop, and nobody else would resolve these
+                for request in batch:
+                    request.cancel.cancel()
+                    if not request.future.done():
+                        request.future.set_exception(RuntimeError("Generation scheduler stopped"))
+                raise
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            
+            for request, output in zip(batch, outputs):
+                if not request.future.done():
+                    request.future.set_result(output)
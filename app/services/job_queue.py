@@ -0,0 +1,413 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from app.models.recipient_model import Recipient
+from app.services.mail_generator import MailGenerator
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    tone TEXT,
+    template TEXT,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_rows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    recipient TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    finished_at REAL,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS job_rows_status ON job_rows (status, id);
+CREATE INDEX IF NOT EXISTS job_rows_job ON job_rows (job_id, idx);
+CREATE INDEX IF NOT EXISTS job_rows_finished ON job_rows (job_id, finished_at);
+"""
+
+# Throughput is measured over this trailing window so restarts don't skew the ETA
+THROUGHPUT_WINDOW_SECONDS = 60
+
+class JobQueue:
+    """SQLite-backed campaign queue with background workers
+    
+    Every recipient is a row in `job_rows`. Workers claim pending rows in
+    FIFO order, generate them and checkpoint each batch in one transaction,
+    so a crash loses at most the rows that were in flight.
+    
+    Several processes can share the database (`--workers N`), so each claim
+    records which queue took the row and when. A queue keeps renewing the
+    claims it is still working on; rows whose claim is older than
+    `lease_seconds` belonged to a dead process and go back to `pending`.
+    Stopping only releases this queue's own rows, and a checkpoint only
+    counts rows the queue still holds, so no row is counted twice.
+    
+    All SQLite access goes through a single-thread executor that owns the
+    connection, so the event loop never blocks on disk.
+    """
+    
+    def __init__(
+        self,
+        db_path: str,
+        workers: int = 2,
+        batch_size: int = 8,
+        poll_interval_ms: int = 1000,
+        priority: int = 10,
+        lease_seconds: float = 300
+    ):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = max(1, poll_interval_ms) / 1000
+        # Scheduler priority for job rows: after interactive requests
+        self.priority = priority
+        self.lease_seconds = max(1.0, lease_seconds)
+        # Written on every row this queue claims
+        self.claimant = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        # Rows being generated right now, whose claims are renewed
+        self._in_flight: Set[int] = set()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.model_loader = None
+        self.stats = {"rows_done": 0, "rows_failed": 0, "rows_resumed": 0}
+    
+    async def _db(self, fn, *args):
+        """Run fn(conn, *args) on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: fn(self._connection(), *args))
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "template" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN template TEXT")
+            row_columns = {row["name"] for row in conn.execute("PRAGMA table_info(job_rows)")}
+            if "claimed_by" not in row_columns:
+                conn.execute("ALTER TABLE job_rows ADD COLUMN claimed_by TEXT")
+                conn.execute("ALTER TABLE job_rows ADD COLUMN claimed_at REAL")
+            self._conn = conn
+        return self._conn
+    
+    async def start(self, model_loader):
+        """Requeue rows of dead processes and start the worker pool"""
+        self.model_loader = model_loader
+        self._wakeup = asyncio.Event()
+        
+        await self._requeue_expired()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._keep_claims()))
+    
+    async def stop(self):
+        """Stop workers; the rows they had claimed are requeued"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        
+        self._in_flight.clear()
+        
+        if self._conn is not None:
+            await self._db(self._release)
+            await self._db(lambda conn: conn.close())
+            self._conn = None
+    
+    def _release(self, conn: sqlite3.Connection) -> int:
+        """Put this queue's running rows back to pending"""
+        return conn.execute(
+            "UPDATE job_rows SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+            "WHERE status = 'running' AND claimed_by = ?",
+            (self.claimant,)
+        ).rowcount
+    
+    def _requeue_stale(self, conn: sqlite3.Connection) -> int:
+        """Put running rows whose claim was not renewed in time (or predates claims) back to pending"""
+        return conn.execute(
+            "UPDATE job_rows SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+            "WHERE status = 'running' AND (claimed_at IS NULL OR claimed_at < ?)",
+            (time.time() - self.lease_seconds,)
+        ).rowcount
+    
+    def _renew(self, conn: sqlite3.Connection, row_ids: Iterable[int]):
+        conn.executemany(
+            "UPDATE job_rows SET claimed_at = ? WHERE id = ? AND status = 'running' AND claimed_by = ?",
+            [(time.time(), row_id, self.claimant) for row_id in row_ids]
+        )
+    
+    async def _requeue_expired(self):
+        resumed = await self._db(self._requeue_stale)
+        self.stats["rows_resumed"] += resumed
+        if resumed:
+            print(f"📥 Resuming {resumed} interrupted job rows")
+            if self._wakeup:
+                self._wakeup.set()
+    
+    async def _keep_claims(self):
+        """Renew the claims being worked on and take over those of dead processes"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self._db(self._renew, list(self._in_flight))
+                await self._requeue_expired()
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Job queue lease renewal failed: {e}")
+    
+    async def submit(
+        self,
+        user_id: str,
+        recipients: List[Recipient],
+        tone: Optional[str] = None,
+        template: Optional[Dict] = None
+    ) -> str:
+        """Store a campaign and return its job id
+        
+        `template` is a {subject, body} snapshot, so editing or deleting the
+        user's template later does not change a queued job.
+        """
+        job_id = uuid.uuid4().hex
+        rows = [(job_id, i, r.model_dump_json()) for i, r in enumerate(recipients)]
+        
+        def insert(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute(
+                    "INSERT INTO jobs (id, user_id, status, tone, template, total, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job_id, user_id, "queued" if rows else "completed", tone,
+                        json.dumps(template) if template else None, len(rows), time.time()
+                    )
+                )
+                conn.executemany("INSERT INTO job_rows (job_id, idx, recipient) VALUES (?, ?, ?)", rows)
+        
+        await self._db(insert)
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id
+    
+    async def get(self, job_id: str) -> Optional[Dict]:
+        """Job status with progress, throughput and ETA"""
+        return await self._db(self._progress, job_id)
+    
+    @staticmethod
+    def _progress(conn: sqlite3.Connection, job_id: str) -> Optional[Dict]:
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        
+        now = time.time()
+        finished = job["done"] + job["failed"]
+        remaining = job["total"] - finished
+        
+        recent = conn.execute(
+            "SELECT COUNT(*), MIN(finished_at) FROM job_rows WHERE job_id = ? AND finished_at >= ?",
+            (job_id, now - THROUGHPUT_WINDOW_SECONDS)
+        ).fetchone()
+        throughput = 0.0
+        if recent[0]:
+            elapsed = max(now - recent[1], 1.0)
+            throughput = recent[0] / elapsed
+        
+        return {
+            "job_id": job["id"],
+            "user_id": job["user_id"],
+            "status": job["status"],
+            "total": job["total"],
+            "done": job["done"],
+            "failed": job["failed"],
+            "progress": finished / job["total"] if job["total"] else 1.0,
+            "throughput_per_second": round(throughput, 3),
+            "eta_seconds": round(remaining / throughput, 1) if throughput and remaining else None,
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"]
+        }
+    
+    async def results(self, job_id: str, page_size: int = 500) -> AsyncIterator[Dict]:
+        """Yield finished rows in input order, a page at a time"""
+        after = -1
+        while True:
+            page = await self._db(self._results_page, job_id, after, page_size)
+            for row in page:
+                yield row
+            if len(page) < page_size:
+                return
+            after = page[-1]["index"]
+    
+    @staticmethod
+    def _results_page(conn: sqlite3.Connection, job_id: str, after: int, limit: int) -> List[Dict]:
+        rows = conn.execute(
+            "SELECT idx, status, result FROM job_rows "
+            "WHERE job_id = ? AND idx > ? AND status IN ('done', 'failed') ORDER BY idx LIMIT ?",
+            (job_id, after, limit)
+        ).fetchall()
+        return [{"index": r["idx"], "status": r["status"], **json.loads(r["result"])} for r in rows]
+    
+    def _claim(self, conn: sqlite3.Connection) -> List[sqlite3.Row]:
+        """Atomically mark the next batch of pending rows as running"""
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "UPDATE job_rows SET status = 'running', claimed_by = ?, claimed_at = ? WHERE id IN "
+                "(SELECT id FROM job_rows WHERE status = 'pending' ORDER BY id LIMIT ?) "
+                "RETURNING id, job_id, idx, recipient",
+                (self.claimant, time.time(), self.batch_size)
+            ).fetchall()
+            job_ids = {r["job_id"] for r in rows}
+            conn.executemany(
+                "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) WHERE id = ?",
+                [(time.time(), job_id) for job_id in job_ids]
+            )
+        return rows
+    
+    def _checkpoint(self, conn: sqlite3.Connection, outcomes: List[tuple]) -> List[tuple]:
+        """Persist a batch of (row_id, job_id, status, result) in one transaction
+        
+        Rows this queue no longer holds (its claim expired and another queue
+        took them over) are skipped. Returns the outcomes that were stored.
+        """
+        now = time.time()
+        counts: Dict[str, List[int]] = {}
+        stored = []
+        
+        with conn:
+            conn.execute("BEGIN")
+            for row_id, job_id, row_status, result in outcomes:
+                updated = conn.execute(
+                    "UPDATE job_rows SET status = ?, result = ?, finished_at = ?, claimed_by = NULL "
+                    "WHERE id = ? AND status = 'running' AND claimed_by = ?",
+                    (row_status, json.dumps(result), now, row_id, self.claimant)
+                ).rowcount
+                if updated:
+                    stored.append((row_id, job_id, row_status, result))
+                    done_failed = counts.setdefault(job_id, [0, 0])
+                    done_failed[0 if row_status == "done" else 1] += 1
+            for job_id, (done, failed) in counts.items():
+                conn.execute(
+                    "UPDATE jobs SET done = done + ?, failed = failed + ?, "
+                    "status = CASE WHEN done + failed + ? + ? >= total THEN 'completed' ELSE status END, "
+                    "finished_at = CASE WHEN done + failed + ? + ? >= total THEN ? ELSE finished_at END "
+                    "WHERE id = ?",
+                    (done, failed, done, failed, done, failed, now, job_id)
+                )
+        return stored
+    
+    async def _job_settings(self, job_id: str) -> Dict:
+        row = await self._db(lambda conn: conn.execute("SELECT tone, template FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        if row is None:
+            return {"tone": None, "template": None}
+        template = None
+        if row["template"]:
+            source = json.loads(row["template"])
+            template = MailGenerator.compile_template(source["subject"], source["body"])
+        return {"tone": row["tone"], "template": template}
+    
+    async def _generate(self, row: sqlite3.Row, recipient: Recipient, mail: Dict, tone: Optional[str]) -> tuple:
+        try:
+            # Jobs queue behind interactive traffic, so no per-request deadline
+            result = await MailGenerator.generate_outreach(
+                recipient,
+                self.model_loader,
+                tone,
+                mail=mail,
+                priority=self.priority,
+                timeout=0
+            )
+            return (row["id"], row["job_id"], "done", result)
+        except Exception as e:
+            return (row["id"], row["job_id"], "failed", {"error": str(e)})
+    
+    async def _run_rows(self, job_id: str, rows: List[sqlite3.Row]) -> List[tuple]:
+        """Render one job's rows in a single batch, then generate them"""
+        try:
+            job = await self._job_settings(job_id)
+        except Exception as e:
+            return [(row["id"], job_id, "failed", {"error": str(e)}) for row in rows]
+        
+        outcomes, valid, recipients = [], [], []
+        for row in rows:
+            try:
+                recipients.append(Recipient.model_validate_json(row["recipient"]))
+                valid.append(row)
+            except ValueError as e:
+                outcomes.append((row["id"], job_id, "failed", {"error": str(e)}))
+        
+        try:
+            mails = MailGenerator.render_batch(recipients, job["template"])
+        except Exception as e:
+            # e.g. a template that only fails on real data: fail the rows, not the worker
+            return outcomes + [(row["id"], job_id, "failed", {"error": f"Template failed to render: {e}"}) for row in valid]
+        outcomes.extend(await asyncio.gather(*(
+            self._generate(row, recipient, mail, job["tone"])
+            for row, recipient, mail in zip(valid, recipients, mails)
+        )))
+        return outcomes
+    
+    async def _worker(self):
+        """Claim, generate, checkpoint, repeat"""
+        while True:
+            try:
+                rows = await self._db(self._claim)
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Job queue claim failed: {e}")
+                rows = []
+            
+            if not rows:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            row_ids = [row["id"] for row in rows]
+            self._in_flight.update(row_ids)
+            try:
+                await self._process(rows)
+            except Exception as e:
+                # The rows stay `running` until their claim expires, then are retried; keep serving other jobs
+                print(f"⚠️ Job queue batch failed: {e!r}")
+                await asyncio.sleep(self.poll_interval)
+            finally:
+                self._in_flight.difference_update(row_ids)
+    
+    async def _process(self, rows: List[sqlite3.Row]):
+        by_job: Dict[str, List[sqlite3.Row]] = {}
+        for row in rows:
+            by_job.setdefault(row["job_id"], []).append(row)
+        
+        # The whole claim goes to the model scheduler together
+        results = await asyncio.gather(*(self._run_rows(job_id, job_rows) for job_id, job_rows in by_job.items()))
+        outcomes = [outcome for job_outcomes in results for outcome in job_outcomes]
+        stored = await self._db(self._checkpoint, outcomes)
+        
+        for outcome in stored:
+            self.stats["rows_done" if outcome[2] == "done" else "rows_failed"] += 1
@@ -1,58 +1,148 @@
-from typing import Dict
+from typing import Dict, Iterable, List, Optional
+
+from app.config import settings
+from app.models.recipient_model import Recipient
+from app.services.template_registry import CompiledTemplate, TemplateRegistry
+
+def _default_body(f: Dict[str, str]) -> str:
+    return f"""Hi {f["recipient_name"]},
+
+I came across your profile and was impressed by your work at {f["company"]}. 
+
+{f["context"]}
+
+I thought you might find this interesting given your role as {f["job_title"]}.
+
+{f"I noticed that {f['company_context']}" if f["company_context"] else ""}
+
+Would you be open to a quick chat?
+
+Best regards,
+SMB02 Team"""
 
 class MailGenerator:
     """Service for generating cold outreach emails"""
     
+    registry = TemplateRegistry(settings.template_cache_size, settings.template_max_length)
+    
+    # The built-in template stays plain Python: f-strings are already compiled
+    # and still render a few times faster than any template engine
+    default_template = CompiledTemplate(
+        subject=lambda f: f"Quick question about {f['company']} 👋",
+        body=_default_body,
+        preview=lambda f: f"Quick question about {f['company']}",
+        personalization_score=0.85
+    )
+    
+    tones = {
+        "professional": "formal and business-oriented",
+        "casual": "friendly and conversational",
+        "urgent": "time-sensitive and compelling",
+        "educational": "informative and value-driven"
+    }
+    
+    # Where the model starts another turn or another email: nothing after it is kept
+    stop_sequences = {
+        "mail": ("\nEMAIL:", "\nWrite a short cold outreach email", "\nUSER:"),
+        "chat": ("\nUSER:", "\nASSISTANT:")
+    }
+    
+    @staticmethod
+    def _fields(recipient: Recipient, company_context: str = "") -> Dict[str, str]:
+        return {
+            "recipient_name": recipient.recipient_name,
+            "company": recipient.company,
+            "job_title": recipient.job_title,
+            "context": recipient.context,
+            "company_context": company_context
+        }
+    
     @staticmethod
     async def generate_cold_mail(
         recipient_name: str,
         company: str,
         job_title: str,
         context: str,
-        company_context: str = ""
-    ) -> Dict[str, str]:
+        company_context: str = "",
+        template: Optional[CompiledTemplate] = None
+    ) -> Dict:
         """Generate personalized cold email"""
         
-        mail_templates = {
-            "subject": f"Quick question about {company} 👋",
-            "body": f"""Hi {recipient_name},
-
-I came across your profile and was impressed by your work at {company}. 
-
-{context}
-
-I thought you might find this interesting given your role as {job_title}.
-
-{f"I noticed that {company_context}" if company_context else ""}
-
-Would you be open to a quick chat?
-
-Best regards,
-SMB02 Team""",
-            "preview": f"Quick question about {company}",
-            "personalization_score": 0.85
-        }
+        return (template or MailGenerator.default_template).render({
+            "recipient_name": recipient_name,
+            "company": company,
+            "job_title": job_title,
+            "context": context,
+            "company_context": company_context
+        })
+    
+    @staticmethod
+    def render_batch(
+        recipients: Iterable[Recipient],
+        template: Optional[CompiledTemplate] = None,
+        company_context: str = ""
+    ) -> List[Dict]:
+        """Render one template for a whole list of recipients"""
+        fields = (MailGenerator._fields(r, company_context) for r in recipients)
+        return (template or MailGenerator.default_template).render_batch(fields)
+    
+    @staticmethod
+    def compile_template(subject: str, body: str) -> CompiledTemplate:
+        """Validate and compile a user template (cached by source)"""
+        return MailGenerator.registry.compile(subject, body)
+    
+    @staticmethod
+    def outreach_prompt(recipient: Recipient) -> str:
+        """Model prompt for one cold email"""
+        return (
+            f"Write a short cold outreach email to {recipient.recipient_name}, "
+            f"{recipient.job_title} at {recipient.company}.\n"
+            f"Context: {recipient.context}\n"
+            "EMAIL:"
+        )
+    
+    @staticmethod
+    async def generate_outreach(
+        recipient: Recipient,
+        model_loader,
+        tone: Optional[str] = None,
+        template: Optional[CompiledTemplate] = None,
+        mail: Optional[Dict] = None,
+        priority: int = 0,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """Template mail plus model-written copy for one recipient
         
-        return mail_templates
+        Pass `mail` when it was already rendered with render_batch.
+        `timeout` overrides GENERATION_TIMEOUT_SECONDS (0 = none). Model
+        failures are raised, so callers can report the row as failed.
+        """
+        if mail is None:
+            mail = (template or MailGenerator.default_template).render(MailGenerator._fields(recipient))
+        message = await model_loader.generate(
+            MailGenerator.outreach_prompt(recipient),
+            max_new_tokens=settings.mail_max_new_tokens,
+            stop=MailGenerator.stop_sequences["mail"],
+            priority=priority,
+            timeout=timeout,
+            raise_errors=True
+        )
+        if tone:
+            message = await MailGenerator.enhance_mail(message, tone)
+        
+        return {"message": message, "generated_mail": mail}
     
     @staticmethod
     async def enhance_mail(original_mail: str, tone: str = "professional") -> str:
         """Enhance mail with better copy"""
         
-        tones = {
-            "professional": "formal and business-oriented",
-            "casual": "friendly and conversational",
-            "urgent": "time-sensitive and compelling",
-            "educational": "informative and value-driven"
-        }
-        
         enhanced = f"""[Enhanced with {tone} tone]
 
 {original_mail}
 
 ---
 This email has been enhanced for better engagement."""
-        
+
         return enhanced
     
     @staticmethod
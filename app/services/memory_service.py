@@ -1,16 +1,233 @@
+import asyncio
 import json
 import os
+import re
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 from uuid import uuid4
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single worker, nothing to coordinate
+    fcntl = None
+
+from app.services.context_builder import ContextBuilder
+
+# Chat ids double as file names, so only plain ids (uuid4 and the like) are accepted
+CHAT_ID_PATTERN = r"^[A-Za-z0-9-]{1,64}$"
+
+class ChatNotFoundError(LookupError):
+    """The chat id is malformed or no such chat exists"""
+
+def _signature(stat: os.stat_result) -> Tuple[int, int, int]:
+    """Changes whenever a chat file is written, replaced or recreated"""
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+@contextmanager
+def _flocked(f):
+    """Hold an exclusive lock on an open file, shared with other worker processes"""
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+        yield f
+    finally:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class ChatCache:
+    """Size-bounded LRU of chat documents"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self.sizes: Dict[Tuple[str, str], int] = {}
+        # Signature of the chat file the entry was read from (or last written to)
+        self.signatures: Dict[Tuple[str, str], Optional[Tuple[int, int, int]]] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def _message_size(message: Dict) -> int:
+        # Rough in-memory footprint: content plus dict/timestamp overhead
+        return len(message["content"]) + 200
+    
+    def get(self, key: Tuple[str, str]) -> Optional[Dict]:
+        chat_data = self.entries.get(key)
+        if chat_data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return chat_data
+    
+    def put(self, key: Tuple[str, str], chat_data: Dict, signature: Optional[Tuple[int, int, int]] = None):
+        self.discard(key)
+        size = 200 + sum(self._message_size(m) for m in chat_data["messages"])
+        self.entries[key] = chat_data
+        self.sizes[key] = size
+        self.signatures[key] = signature
+        self.total_bytes += size
+        self._evict()
+    
+    def append(self, key: Tuple[str, str], message: Dict):
+        """Append a message to a cached chat (no-op if it is not cached)"""
+        chat_data = self.entries.get(key)
+        if chat_data is None:
+            return
+        chat_data["messages"].append(message)
+        chat_data["updated_at"] = message["timestamp"]
+        size = self._message_size(message)
+        self.sizes[key] += size
+        self.total_bytes += size
+        self.entries.move_to_end(key)
+        self._evict()
+    
+    def discard(self, key: Tuple[str, str]):
+        if key in self.entries:
+            del self.entries[key]
+            del self.signatures[key]
+            self.total_bytes -= self.sizes.pop(key)
+    
+    def invalidate(self, key: Tuple[str, str]):
+        """Drop an entry whose chat file was changed by another process"""
+        self.discard(key)
+        self.invalidations += 1
+    
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, _ = self.entries.popitem(last=False)
+            del self.signatures[key]
+            self.total_bytes -= self.sizes.pop(key)
+            self.evictions += 1
+    
+    @property
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
+        }
 
 class MemoryService:
-    """Service for managing conversation memory (file-based)"""
+    """Service for managing conversation memory (file-based)
+    
+    Each chat is an append-only JSONL log: the first line is a header with the
+    chat metadata and every following line is one message. Legacy `<chat_id>.json`
+    documents are still read and are converted to a log on their next write.
+    
+    Each user directory also holds `_manifest.jsonl`, an append-only log of chat
+    summary updates, so listing chats never has to open the chat logs.
     
-    def __init__(self, memory_dir: str = "./memory"):
+    All disk work runs on a bounded thread pool. Writes to a chat are serialized
+    by a per-chat lock and manifest updates by a per-user lock (always taken in
+    that order). Several worker processes may share the memory directory:
+    appends lock the file they write to and manifest updates lock
+    `_manifest.lock`, with flock.
+    
+    Hot chats are kept in a size-bounded LRU. A cache hit checks the chat
+    file's signature (inode, size, mtime) and re-reads the chat if another
+    worker has written to it since. Once `start()` has been called,
+    new messages are buffered in memory and written behind: each flush coalesces
+    everything a chat received since the last one into a single append.
+    
+    Messages carry their token count (per tokenizer) so prompts can be built
+    from a token-bounded window without re-tokenizing history.
+    """
+    
+    MANIFEST_FILE = "_manifest.jsonl"
+    
+    def __init__(
+        self,
+        memory_dir: str = "./memory",
+        fsync: str = "never",
+        io_workers: int = 8,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        flush_interval_ms: int = 500,
+        context_max_tokens: int = 1024,
+        context_summary_tokens: int = 0
+    ):
         self.memory_dir = Path(memory_dir)
         self.memory_dir.mkdir(parents=True, exist_ok=True)
+        # "always" fsyncs every append, "never" leaves flushing to the OS
+        self.fsync = fsync
+        self.executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="memory-io")
+        self._chat_locks = weakref.WeakValueDictionary()
+        self._user_locks = weakref.WeakValueDictionary()
+        
+        self.cache = ChatCache(cache_max_bytes)
+        self.flush_interval = flush_interval_ms / 1000
+        # (user_id, chat_id) -> {"created_at": str or None, "messages": [...]} not yet on disk
+        self._pending: Dict[Tuple[str, str], Dict] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_messages = 0
+        
+        self.context_builder = ContextBuilder(context_max_tokens, context_summary_tokens)
+    
+    def use_tokenizer(self, counter):
+        """Count context tokens with the model's tokenizer (anything with count_tokens and tokenizer_id)"""
+        self.context_builder.use_tokenizer(counter)
+    
+    def start(self):
+        """Enable write-behind and start the periodic flusher"""
+        if self.flush_interval > 0 and (self._flusher is None or self._flusher.done()):
+            self._flusher = asyncio.create_task(self._flush_loop())
+    
+    async def close(self):
+        """Stop the flusher and write everything still buffered"""
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+    
+    @property
+    def _write_behind(self) -> bool:
+        return self._flusher is not None and not self._flusher.done()
+    
+    @property
+    def stats(self) -> Dict:
+        """Cache and write-behind counters"""
+        return {
+            **self.cache.stats,
+            "pending_chats": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+            "context": self.context_builder.stats
+        }
+    
+    async def _io(self, fn, *args):
+        """Run blocking file work on the I/O pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+    
+    def _lock(self, locks: weakref.WeakValueDictionary, key) -> asyncio.Lock:
+        lock = locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            locks[key] = lock
+        return lock
+    
+    def _chat_lock(self, user_id: str, chat_id: str) -> asyncio.Lock:
+        return self._lock(self._chat_locks, (user_id, chat_id))
+    
+    def _user_lock(self, user_id: str) -> asyncio.Lock:
+        return self._lock(self._user_locks, user_id)
     
     def get_user_dir(self, user_id: str) -> Path:
         """Get user's memory directory"""
@@ -18,95 +235,425 @@ class MemoryService:
         user_dir.mkdir(parents=True, exist_ok=True)
         return user_dir
     
-    async def create_chat(self, user_id: str) -> str:
-        """Create new chat session"""
-        chat_id = str(uuid4())
-        user_dir = self.get_user_dir(user_id)
-        chat_file = user_dir / f"{chat_id}.json"
+    @staticmethod
+    def valid_chat_id(chat_id: str) -> bool:
+        """Whether chat_id can name a chat (never the manifest or a path)"""
+        return bool(re.match(CHAT_ID_PATTERN, chat_id or ""))
+    
+    def _chat_file(self, user_id: str, chat_id: str, suffix: str) -> Path:
+        if not self.valid_chat_id(chat_id):
+            raise ChatNotFoundError(f"Invalid chat id: {chat_id!r}")
+        return self.get_user_dir(user_id) / f"{chat_id}{suffix}"
+    
+    def _log_file(self, user_id: str, chat_id: str) -> Path:
+        return self._chat_file(user_id, chat_id, ".jsonl")
+    
+    def _legacy_file(self, user_id: str, chat_id: str) -> Path:
+        return self._chat_file(user_id, chat_id, ".json")
+    
+    def _manifest_file(self, user_id: str) -> Path:
+        return self.get_user_dir(user_id) / self.MANIFEST_FILE
+    
+    def _append(self, log_file: Path, records: List[Dict], create: bool = True) -> Tuple[Tuple, Tuple]:
+        """Append records to a log as one write, returns its signature before and after
         
-        chat_data = {
-            "chat_id": chat_id,
-            "messages": [],
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+        Without `create` a missing file raises FileNotFoundError instead of
+        being created.
+        """
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        flags = os.O_WRONLY | os.O_APPEND | (os.O_CREAT if create else 0)
+        with _flocked(os.fdopen(os.open(log_file, flags, 0o644), "a")) as f:
+            before = _signature(os.fstat(f.fileno()))
+            f.write(data)
+            f.flush()
+            if self.fsync == "always":
+                os.fsync(f.fileno())
+            return before, _signature(os.fstat(f.fileno()))
+    
+    def _chat_signature(self, user_id: str, chat_id: str) -> Optional[Tuple[int, int, int]]:
+        """Signature of the chat's file on disk, None if there is none"""
+        for chat_file in (self._log_file(user_id, chat_id), self._legacy_file(user_id, chat_id)):
+            try:
+                return _signature(os.stat(chat_file))
+            except FileNotFoundError:
+                continue
+        return None
+    
+    @contextmanager
+    def _manifest_lock(self, user_id: str):
+        """Cross-process lock for a user's manifest (it is replaced wholesale on compaction)"""
+        with open(self.get_user_dir(user_id) / "_manifest.lock", "a") as f:
+            with _flocked(f):
+                yield
+    
+    def _read_log(self, log_file: Path) -> Dict:
+        """Rebuild the chat document from its log"""
+        header = None
+        messages = []
+        with open(log_file, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn trailing write after a crash
+                    continue
+                if header is None:
+                    header = record
+                else:
+                    messages.append(record)
+        
+        return {
+            "chat_id": header["chat_id"],
+            "messages": messages,
+            "created_at": header["created_at"],
+            "updated_at": messages[-1]["timestamp"] if messages else header["created_at"]
         }
+    
+    def _migrate_legacy(self, user_id: str, chat_id: str) -> bool:
+        """Convert a legacy JSON chat into a log, returns False if there is none"""
+        legacy_file = self._legacy_file(user_id, chat_id)
+        if not legacy_file.exists():
+            return False
         
-        with open(chat_file, "w") as f:
-            json.dump(chat_data, f, indent=2)
+        with open(legacy_file, "r") as f:
+            chat_data = json.load(f)
         
-        return chat_id
+        log_file = self._log_file(user_id, chat_id)
+        tmp_file = log_file.with_suffix(".jsonl.tmp")
+        header = {"chat_id": chat_data["chat_id"], "created_at": chat_data["created_at"]}
+        with open(tmp_file, "w") as f:
+            for record in [header] + chat_data["messages"]:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_file, log_file)
+        legacy_file.unlink()
+        return True
     
-    async def add_message(self, user_id: str, chat_id: str, role: str, content: str):
-        """Add message to chat"""
+    def _summarize(self, chat_data: Dict) -> Dict:
+        """Summary fields kept in the manifest for one chat"""
+        return {
+            "chat_id": chat_data["chat_id"],
+            "created_at": chat_data["created_at"],
+            "updated_at": chat_data["updated_at"],
+            "message_count": len(chat_data["messages"]),
+            "preview": chat_data["messages"][0]["content"][:50] if chat_data["messages"] else ""
+        }
+    
+    def _read_manifest(self, user_id: str) -> Dict[str, Dict]:
+        """Replay the manifest log into chat_id -> summary"""
+        summaries = {}
+        records = 0
+        with open(self._manifest_file(user_id), "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(record, dict) or "op" not in record or "chat_id" not in record:
+                    # Not a manifest record (e.g. a chat log written here before chat ids were checked)
+                    continue
+                records += 1
+                op = record.pop("op")
+                chat_id = record["chat_id"]
+                
+                if op == "put":
+                    summaries[chat_id] = record
+                elif op == "create":
+                    summaries[chat_id] = {
+                        "chat_id": chat_id,
+                        "created_at": record["created_at"],
+                        "updated_at": record["created_at"],
+                        "message_count": 0,
+                        "preview": ""
+                    }
+                elif op == "message" and chat_id in summaries:
+                    summary = summaries[chat_id]
+                    summary["updated_at"] = record["timestamp"]
+                    summary["message_count"] += 1
+                    if not summary["preview"]:
+                        summary["preview"] = record["preview"]
+                elif op == "delete":
+                    summaries.pop(chat_id, None)
+        
+        # Compact once superseded records dominate the log
+        if records > 2 * len(summaries) + 100:
+            self._write_manifest(user_id, summaries)
+        
+        return summaries
+    
+    def _write_manifest(self, user_id: str, summaries: Dict[str, Dict]):
+        """Atomically replace the manifest with one record per chat"""
+        manifest_file = self._manifest_file(user_id)
+        tmp_file = manifest_file.with_suffix(".jsonl.tmp")
+        with open(tmp_file, "w") as f:
+            for summary in summaries.values():
+                f.write(json.dumps({"op": "put", **summary}) + "\n")
+        os.replace(tmp_file, manifest_file)
+    
+    def _update_manifest(self, user_id: str, records: List[Dict]):
+        """Record summary changes (called after the chat files are written)"""
+        with self._manifest_lock(user_id):
+            if not self._manifest_file(user_id).exists():
+                # A fresh rebuild already reflects this change
+                self._rebuild_manifest(user_id)
+                return
+            self._append(self._manifest_file(user_id), records)
+    
+    def rebuild_manifest(self, user_id: str) -> int:
+        """Rebuild a user's manifest from the chat files on disk, returns the chat count"""
+        with self._manifest_lock(user_id):
+            return self._rebuild_manifest(user_id)
+    
+    def _rebuild_manifest(self, user_id: str) -> int:
         user_dir = self.get_user_dir(user_id)
-        chat_file = user_dir / f"{chat_id}.json"
+        chat_ids = {p.stem for p in user_dir.glob("*.jsonl")} | {p.stem for p in user_dir.glob("*.json")}
+        chat_ids = {chat_id for chat_id in chat_ids if self.valid_chat_id(chat_id)}
         
-        if not chat_file.exists():
-            # Create chat if doesn't exist
-            await self.create_chat(user_id)
+        summaries = {}
+        for chat_id in chat_ids:
+            chat_data = self._load_chat(user_id, chat_id)
+            if chat_data:
+                summaries[chat_id] = self._summarize(chat_data)
         
-        with open(chat_file, "r") as f:
-            chat_data = json.load(f)
+        self._write_manifest(user_id, summaries)
+        return len(summaries)
+    
+    def rebuild_all_manifests(self) -> Dict[str, int]:
+        """Rebuild the manifest of every user, returns user_id -> chat count"""
+        return {
+            user_dir.name: self.rebuild_manifest(user_dir.name)
+            for user_dir in self.memory_dir.iterdir()
+            if user_dir.is_dir()
+        }
+    
+    def _write_chat_header(self, user_id: str, chat_id: str, created_at: Optional[str] = None) -> str:
+        created_at = created_at or datetime.now().isoformat()
+        self._append(self._log_file(user_id, chat_id), [{
+            "chat_id": chat_id,
+            "created_at": created_at
+        }])
+        return created_at
+    
+    def _append_messages(self, user_id: str, chat_id: str, messages: List[Dict]) -> Tuple[Tuple, Tuple]:
+        """Append messages to an existing chat, returns the log signature before and after"""
+        log_file = self._log_file(user_id, chat_id)
+        if not log_file.exists():
+            self._migrate_legacy(user_id, chat_id)
+        try:
+            # Never recreate a log another worker has just deleted
+            return self._append(log_file, messages, create=False)
+        except FileNotFoundError:
+            raise ChatNotFoundError(f"Chat {chat_id} not found") from None
+    
+    def _delete_chat_files(self, user_id: str, chat_id: str) -> bool:
+        deleted = False
+        for chat_file in (self._log_file(user_id, chat_id), self._legacy_file(user_id, chat_id)):
+            if chat_file.exists():
+                chat_file.unlink()
+                deleted = True
+        return deleted
+    
+    def _list_chats(self, user_id: str) -> List[Dict]:
+        with self._manifest_lock(user_id):
+            if not self._manifest_file(user_id).exists():
+                self._rebuild_manifest(user_id)
+            summaries = self._read_manifest(user_id)
+        return sorted(summaries.values(), key=lambda c: c["updated_at"], reverse=True)
+    
+    def _load_chat_signed(self, user_id: str, chat_id: str) -> Tuple[Optional[Tuple[int, int, int]], Optional[Dict]]:
+        """Chat document with the signature of the file it came from"""
+        # Taken first: a write that lands mid-read only makes the next hit re-read
+        signature = self._chat_signature(user_id, chat_id)
+        return signature, self._load_chat(user_id, chat_id)
+    
+    def _load_chat(self, user_id: str, chat_id: str) -> Optional[Dict]:
+        log_file = self._log_file(user_id, chat_id)
+        if log_file.exists():
+            return self._read_log(log_file)
         
-        chat_data["messages"].append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
-        chat_data["updated_at"] = datetime.now().isoformat()
+        legacy_file = self._legacy_file(user_id, chat_id)
+        if legacy_file.exists():
+            with open(legacy_file, "r") as f:
+                return json.load(f)
         
-        with open(chat_file, "w") as f:
-            json.dump(chat_data, f, indent=2)
+        return None
+    
+    async def _flush_chat(self, user_id: str, chat_id: str):
+        """Write a chat's buffered messages as one append (caller holds the chat lock)
+        
+        If the append fails the messages go back into the buffer for the next flush.
+        """
+        key = (user_id, chat_id)
+        pending = self._pending.pop(key, None)
+        if not pending or not pending["messages"]:
+            return
+        
+        messages = pending["messages"]
+        try:
+            before, after = await self._io(self._append_messages, user_id, chat_id, messages)
+        except ChatNotFoundError:
+            # The chat is gone, so there is nowhere to keep them
+            raise
+        except Exception:
+            later = self._pending.get(key)
+            self._pending[key] = {"messages": messages + (later["messages"] if later else [])}
+            raise
+        
+        if key in self.cache.entries:
+            if self.cache.signatures[key] == before:
+                # The cached chat already holds these messages: it now matches the file again
+                self.cache.signatures[key] = after
+            else:
+                # Another worker wrote in between
+                self.cache.invalidate(key)
+        
+        records = [{
+            "op": "message",
+            "chat_id": chat_id,
+            "timestamp": message["timestamp"],
+            "preview": message["content"][:50]
+        } for message in messages]
+        
+        async with self._user_lock(user_id):
+            await self._io(self._update_manifest, user_id, records)
+        
+        self.flushes += 1
+        self.flushed_messages += len(messages)
+    
+    async def flush(self, user_id: Optional[str] = None):
+        """Write buffered messages to disk (all users, or only one)
+        
+        A chat that fails to flush does not hold up the others; the first
+        error is raised once they have all been tried.
+        """
+        error = None
+        for key in list(self._pending):
+            if user_id is None or key[0] == user_id:
+                async with self._chat_lock(*key):
+                    try:
+                        await self._flush_chat(*key)
+                    except Exception as e:
+                        error = error or e
+        if error:
+            raise error
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Memory flush failed: {e}")
+    
+    async def _cached_chat(self, user_id: str, chat_id: str, check: bool = True) -> Optional[Dict]:
+        """Chat document from cache, else disk plus buffered messages (caller holds the chat lock)
+        
+        `check=False` trusts a cached chat without looking at its file, for
+        writers: a flush notices the file changed and drops the entry then.
+        """
+        key = (user_id, chat_id)
+        chat_data = self.cache.get(key)
+        if chat_data is not None and not check:
+            return chat_data
+        if chat_data is not None:
+            signature = await self._io(self._chat_signature, user_id, chat_id)
+            if signature == self.cache.signatures[key]:
+                return chat_data
+            # Written (or deleted) by another worker since it was cached
+            self.cache.invalidate(key)
+        
+        signature, chat_data = await self._io(self._load_chat_signed, user_id, chat_id)
+        pending = self._pending.get(key)
+        if chat_data is not None and pending and pending["messages"]:
+            chat_data["messages"].extend(pending["messages"])
+            chat_data["updated_at"] = pending["messages"][-1]["timestamp"]
+        
+        if chat_data is not None:
+            self.cache.put(key, chat_data, signature)
+        return chat_data
+    
+    async def create_chat(self, user_id: str, chat_id: Optional[str] = None) -> str:
+        """Create new chat session"""
+        chat_id = chat_id or str(uuid4())
+        if not self.valid_chat_id(chat_id):
+            raise ValueError(f"Invalid chat id: {chat_id!r}")
+        
+        async with self._chat_lock(user_id, chat_id):
+            created_at = await self._io(self._write_chat_header, user_id, chat_id)
+            async with self._user_lock(user_id):
+                await self._io(self._update_manifest, user_id, [{
+                    "op": "create",
+                    "chat_id": chat_id,
+                    "created_at": created_at
+                }])
+        
+        return chat_id
+    
+    async def add_message(self, user_id: str, chat_id: str, role: str, content: str):
+        """Add message to an existing chat (ChatNotFoundError if there is none)"""
+        key = (user_id, chat_id)
+        if not self.valid_chat_id(chat_id):
+            raise ChatNotFoundError(f"Invalid chat id: {chat_id!r}")
+        
+        async with self._chat_lock(user_id, chat_id):
+            if await self._cached_chat(user_id, chat_id, check=False) is None:
+                raise ChatNotFoundError(f"Chat {chat_id} not found")
+            
+            message = {
+                "role": role,
+                "content": content,
+                "timestamp": datetime.now().isoformat()
+            }
+            # Counted once here and stored with the message
+            self.context_builder.message_tokens(message)
+            
+            pending = self._pending.setdefault(key, {"messages": []})
+            pending["messages"].append(message)
+            self.cache.append(key, message)
+            
+            if not self._write_behind:
+                await self._flush_chat(user_id, chat_id)
     
     async def get_chat(self, user_id: str, chat_id: str) -> Optional[Dict]:
         """Get chat history"""
-        user_dir = self.get_user_dir(user_id)
-        chat_file = user_dir / f"{chat_id}.json"
-        
-        if not chat_file.exists():
+        if not self.valid_chat_id(chat_id):
             return None
+        async with self._chat_lock(user_id, chat_id):
+            chat_data = await self._cached_chat(user_id, chat_id)
         
-        with open(chat_file, "r") as f:
-            return json.load(f)
+        if chat_data is None:
+            return None
+        # Callers get their own copy so they cannot mutate the cache
+        return {**chat_data, "messages": list(chat_data["messages"])}
     
     async def list_chats(self, user_id: str) -> List[Dict]:
-        """List all chats for user"""
-        user_dir = self.get_user_dir(user_id)
-        chats = []
-        
-        for chat_file in sorted(user_dir.glob("*.json"), reverse=True):
-            with open(chat_file, "r") as f:
-                chat_data = json.load(f)
-                chats.append({
-                    "chat_id": chat_data["chat_id"],
-                    "created_at": chat_data["created_at"],
-                    "updated_at": chat_data["updated_at"],
-                    "message_count": len(chat_data["messages"]),
-                    "preview": chat_data["messages"][0]["content"][:50] if chat_data["messages"] else ""
-                })
-        
-        return chats
+        """List all chats for user, most recently updated first"""
+        await self.flush(user_id)
+        async with self._user_lock(user_id):
+            return await self._io(self._list_chats, user_id)
     
     async def delete_chat(self, user_id: str, chat_id: str) -> bool:
         """Delete chat"""
-        user_dir = self.get_user_dir(user_id)
-        chat_file = user_dir / f"{chat_id}.json"
+        key = (user_id, chat_id)
+        if not self.valid_chat_id(chat_id):
+            return False
         
-        if chat_file.exists():
-            chat_file.unlink()
-            return True
-        return False
+        async with self._chat_lock(user_id, chat_id):
+            had_pending = self._pending.pop(key, None) is not None
+            self.cache.discard(key)
+            self.context_builder.forget(key)
+            deleted = await self._io(self._delete_chat_files, user_id, chat_id)
+            if deleted:
+                async with self._user_lock(user_id):
+                    await self._io(self._update_manifest, user_id, [{"op": "delete", "chat_id": chat_id}])
+        return deleted or had_pending
     
     async def get_context(self, user_id: str, chat_id: str) -> str:
-        """Get formatted context for model input"""
-        chat_data = await self.get_chat(user_id, chat_id)
-        if not chat_data:
+        """Get formatted context for model input, bounded by the token budget"""
+        key = (user_id, chat_id)
+        if not self.valid_chat_id(chat_id):
             return ""
-        
-        context = ""
-        for msg in chat_data["messages"]:
-            role = msg["role"].upper()
-            content = msg["content"]
-            context += f"{role}: {content}\n"
-        
-        return context
\ No newline at end of file
+        async with self._chat_lock(user_id, chat_id):
+            chat_data = await self._cached_chat(user_id, chat_id)
+            if not chat_data:
+                return ""
+            return self.context_builder.build(key, chat_data["messages"])
@@ -0,0 +1,198 @@
+import ctypes
+import gc
+import json
+import shutil
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Set, Tuple, Type
+
+try:
+    import fcntl
+except ImportError:  # Windows: single worker, nothing to coordinate
+    fcntl = None
+
+# Weight files transformers may find in a model directory
+WEIGHT_PATTERNS = ("*.safetensors", "*.bin", "*.pt", "*.pth", "*.index.json")
+SAFETENSORS_DTYPES = {"float32": "F32", "float16": "F16", "bfloat16": "BF16"}
+
+@contextmanager
+def cache_lock(model_path: Path):
+    """Exclusive lock shared by all workers preparing the same model directory"""
+    lock_path = model_path.with_name(model_path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _stored_float_dtypes(path: Path) -> Set[str]:
+    """Floating point dtypes in a safetensors file, read from its header only"""
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    return {
+        info["dtype"] for name, info in header.items()
+        if name != "__metadata__" and info["dtype"] in SAFETENSORS_DTYPES.values()
+    }
+
+def ensure_safetensors(model_path: str, dtype) -> bool:
+    """Rewrite the cached checkpoint as safetensors in `dtype` unless it already is
+    
+    transformers keeps CPU tensors loaded from safetensors backed by the
+    file's mmap when no dtype conversion is needed. Every worker process then
+    maps the same read-only page-cache pages instead of holding a private
+    copy. Returns True if the checkpoint was converted.
+    """
+    path = Path(model_path)
+    wanted = SAFETENSORS_DTYPES[str(dtype).replace("torch.", "")]
+    
+    with cache_lock(path):
+        files = sorted(path.glob("*.safetensors"))
+        if files and all(_stored_float_dtypes(f) <= {wanted} for f in files):
+            return False
+        
+        from transformers import AutoModelForCausalLM
+        print(f"📦 Converting cached model to {wanted} safetensors (one-off)")
+        converted = path.with_name(path.name + ".converting")
+        shutil.rmtree(converted, ignore_errors=True)
+        try:
+            model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=dtype, low_cpu_mem_usage=True)
+            model.save_pretrained(converted, safe_serialization=True)
+            del model
+            _trim_heap()
+        except Exception as e:
+            # e.g. a GPU-only quantized checkpoint: serve the original files
+            print(f"⚠️ Could not convert cached model, loading it as is: {e}")
+            shutil.rmtree(converted, ignore_errors=True)
+            return False
+        
+        for pattern in WEIGHT_PATTERNS:
+            for old in path.glob(pattern):
+                old.unlink()
+        for new in converted.iterdir():
+            new.replace(path / new.name)
+        converted.rmdir()
+        return True
+
+def _trim_heap():
+    """Return freed heap memory to the OS"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def _release_fp32_weights(model):
+    """Drop the fp32 checkpoint once the int8 weights exist
+    
+    Weights are loaded from a memory-mapped safetensors file, and any tensor
+    still pointing into it keeps the whole mapping resident. Copying the
+    remaining (small) tensors out lets it go; malloc_trim then returns the
+    freed heap to the OS.
+    """
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        tensor.data = tensor.data.clone()
+    _trim_heap()
+
+class ModelBackend:
+    """Loads a causal LM and its tokenizer for BitNetLoader
+    
+    Every backend returns objects with the Hugging Face `generate` /
+    tokenizer API, so batching, streaming and the prefix cache work the
+    same whichever one is selected with MODEL_BACKEND.
+    """
+    
+    name = "base"
+    # False for backends that never touch Hugging Face (nothing to download)
+    needs_weights = True
+    
+    def load(self, model_path: str) -> Tuple[Any, Any]:
+        raise NotImplementedError
+
+class MockBackend(ModelBackend):
+    """Canned responses for development and tests"""
+    
+    name = "mock"
+    needs_weights = False
+    
+    def load(self, model_path: str) -> Tuple[Any, Any]:
+        return {"mock": True}, {"mock": True}
+
+class HFBackend(ModelBackend):
+    """Plain transformers model, placed on whatever devices are available"""
+    
+    name = "hf"
+    
+    def _tokenizer(self, model_path: str):
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_path)
+    
+    def load(self, model_path: str) -> Tuple[Any, Any]:
+        import torch
+        from transformers import AutoModelForCausalLM
+        
+        if not torch.cuda.is_available():
+            # fp32 safetensors load without a copy, so workers share the weights
+            ensure_safetensors(model_path, torch.float32)
+        model = AutoModelForCausalLM.from_pretrained(model_path, device_map="auto")
+        return model, self._tokenizer(model_path)
+
+class CPUInt8Backend(HFBackend):
+    """fp32 weights on CPU with Linear layers dynamically quantized to int8
+    
+    Dynamic quantization stores Linear weights as int8 and quantizes
+    activations on the fly, which cuts weight memory by about 4x and runs
+    the matmuls on int8 kernels. `torch.compile` can be layered on top; it
+    pays a one-off compile per new input shape.
+    """
+    
+    name = "cpu-int8"
+    
+    def __init__(self, threads: int = 0, compile: bool = False):
+        self.threads = threads
+        self.compile = compile
+    
+    def load(self, model_path: str) -> Tuple[Any, Any]:
+        import torch
+        from transformers import AutoModelForCausalLM
+        
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        
+        # Quantized weights are private to each worker, but loading from
+        # safetensors avoids unpickling a second fp32 copy first
+        ensure_safetensors(model_path, torch.float32)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True
+        )
+        model.eval()
+        # In place: a copy would briefly hold the fp32 model twice
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        _release_fp32_weights(model)
+        
+        if self.compile:
+            model.forward = torch.compile(model.forward, dynamic=True)
+        
+        return model, self._tokenizer(model_path)
+
+BACKENDS: Dict[str, Type[ModelBackend]] = {
+    MockBackend.name: MockBackend,
+    HFBackend.name: HFBackend,
+    CPUInt8Backend.name: CPUInt8Backend
+}
+
+def create_backend(settings) -> ModelBackend:
+    """Backend named by settings.model_backend"""
+    name = settings.model_backend.lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown MODEL_BACKEND '{name}', expected one of: {', '.join(BACKENDS)}")
+    if name == CPUInt8Backend.name:
+        return CPUInt8Backend(threads=settings.cpu_threads, compile=settings.torch_compile)
+    return BACKENDS[name]()
@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import bcrypt
+
+class HashingPoolSaturated(Exception):
+    """Raised when too many password hashes are already running or queued"""
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so it never blocks the event loop
+    
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most `workers` hashes run at once and at most `queue_limit` more may
+    wait; anything beyond that is rejected immediately.
+    """
+    
+    def __init__(self, workers: int = 4, queue_limit: int = 32):
+        self.workers = max(1, workers)
+        self.queue_limit = max(0, queue_limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.rejected = 0
+    
+    async def _run(self, fn: Callable, *args):
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HashingPoolSaturated()
+        
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+    
+    @staticmethod
+    def _hash(password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    
+    @staticmethod
+    def _verify(password: str, password_hash: str) -> bool:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+    
+    async def hash(self, password: str) -> str:
+        """Hash password with bcrypt"""
+        return await self._run(self._hash, password)
+    
+    async def verify(self, password: str, password_hash: str) -> bool:
+        """Verify password against hash"""
+        return await self._run(self._verify, password, password_hash)
+    
+    @property
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "rejected": self.rejected}
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+class PrefixCache:
+    """Memory-capped LRU of attention caches (past_key_values) for chat prompts
+    
+    Each chat keeps the cache of its last prompt together with that prompt's
+    token ids and a hash of them. A new prompt reuses the longest token prefix
+    it shares with the cached one, so a turn that only appends to the history
+    prefills just the appended tokens. Entries are evicted least recently used
+    once their tensors exceed `max_bytes`.
+    
+    Used from generation threads, so every operation takes a lock. Cached
+    tensors are never modified in place; callers get sliced views.
+    """
+    
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # cache_key -> {"tokens": 1-D tensor, "hash": str, "past": tuple, "bytes": int}
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+    
+    @staticmethod
+    def _hash(tokens) -> str:
+        return hashlib.sha1(tokens.numpy().tobytes()).hexdigest()
+    
+    @staticmethod
+    def _size(past) -> int:
+        return sum(t.numel() * t.element_size() for layer in past for t in layer)
+    
+    @staticmethod
+    def _slice(past, length: int) -> Tuple:
+        return tuple(tuple(t[:, :, :length] for t in layer) for layer in past)
+    
+    def lookup(self, cache_key: str, tokens) -> Tuple[Optional[Tuple], int]:
+        """Cached past for the longest shared prefix of `tokens`, and its length"""
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return None, 0
+            self.entries.move_to_end(cache_key)
+        
+        cached = entry["tokens"]
+        length = min(len(cached), len(tokens))
+        if length == len(cached) and self._hash(tokens[:length]) == entry["hash"]:
+            shared = length
+        else:
+            # History was edited or the window slid: fall back to the common prefix
+            mismatch = (cached[:length] != tokens[:length]).nonzero()
+            shared = int(mismatch[0]) if len(mismatch) else length
+        
+        with self.lock:
+            if shared == 0:
+                self.misses += 1
+                return None, 0
+            self.hits += 1
+            self.reused_tokens += shared
+        return self._slice(entry["past"], shared), shared
+    
+    def store(self, cache_key: str, tokens, past: Tuple):
+        """Keep the cache of a prompt for the chat's next turn"""
+        # A trimmed reuse is a view into the old entry; copy it so that can be freed
+        past = tuple(tuple(t.contiguous() for t in layer) for layer in past)
+        size = self._size(past)
+        with self.lock:
+            self._discard(cache_key)
+            if size > self.max_bytes:
+                return
+            self.entries[cache_key] = {
+                "tokens": tokens.clone(),
+                "hash": self._hash(tokens),
+                "past": past,
+                "bytes": size
+            }
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted["bytes"]
+                self.evictions += 1
+    
+    def _discard(self, cache_key: str):
+        entry = self.entries.pop(cache_key, None)
+        if entry is not None:
+            self.total_bytes -= entry["bytes"]
+    
+    def discard(self, cache_key: str):
+        with self.lock:
+            self._discard(cache_key)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+    
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "reused_tokens": self.reused_tokens,
+            "prefilled_tokens": self.prefilled_tokens
+        }
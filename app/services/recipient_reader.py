@@ -0,0 +1,173 @@
+import asyncio
+import csv
+import io
+import json
+import tempfile
+import threading
+from typing import IO, Iterator, List, Optional, Tuple
+
+from fastapi import Request
+
+from app.models.recipient_model import Recipient
+
+CONTENT_TYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain")
+
+# Uploads larger than this are spooled to disk instead of held in memory
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+# How much of a JSON array is read per step
+JSON_CHUNK_SIZE = 64 * 1024
+
+# Errors that end reading a malformed upload (pydantic's ValidationError is a ValueError)
+PARSE_ERRORS = (ValueError, csv.Error)
+
+class UploadTooLarge(Exception):
+    """The request body is over the upload limit"""
+
+def content_type(request: Request) -> str:
+    return request.headers.get("content-type", "").split(";")[0].strip()
+
+async def spool_body(request: Request, max_bytes: int = 0) -> IO[bytes]:
+    """Copy the request body into a temp file without buffering all of it in memory
+    
+    The body has to be consumed before a streaming response starts, because
+    the response listens on the same ASGI channel for client disconnects.
+    Raises UploadTooLarge once more than `max_bytes` arrive (0 = no limit).
+    """
+    length = request.headers.get("content-length", "")
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            # Chunked uploads don't announce their size
+            spool.close()
+            raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+def _iter_json_array(text: IO[str]) -> Iterator:
+    """Elements of a top-level JSON array, decoded one at a time from the stream"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    
+    def fill(size: int = JSON_CHUNK_SIZE) -> bool:
+        """Read more, dropping what has been consumed; False at end of input"""
+        nonlocal buffer, pos
+        chunk = text.read(size)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return bool(chunk)
+    
+    def next_char() -> str:
+        """First character that isn't whitespace, "" at end of input"""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return buffer[pos:pos + 1]
+    
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array of recipients")
+    pos += 1
+    
+    first = True
+    while True:
+        char = next_char()
+        if char == "]":
+            pos += 1
+            if next_char():
+                raise ValueError("Unexpected data after the JSON array")
+            return
+        if not first:
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in the JSON array" if char else "Unterminated JSON array")
+            pos += 1
+            next_char()
+        first = False
+        
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Possibly cut off at the chunk boundary; reading as much again
+                # keeps re-parsing a large element linear overall
+                if fill(max(JSON_CHUNK_SIZE, len(buffer))):
+                    continue
+                raise
+            # A number could continue in the next chunk ("1.5" of "1.5e3")
+            number = isinstance(element, (int, float)) and not isinstance(element, bool)
+            if not number or (end < len(buffer) and buffer[end] not in "0123456789+-.eE") or not fill():
+                break
+        pos = end
+        yield element
+
+def iter_recipients(body: IO[bytes], kind: str) -> Iterator[Recipient]:
+    """Parse recipients from a spooled CSV, NDJSON or JSON-array body
+    
+    Every format is read row by row, so memory stays flat for any upload
+    size. Malformed input raises one of PARSE_ERRORS.
+    """
+    text = io.TextIOWrapper(body, encoding="utf-8-sig", errors="replace", newline="")
+    
+    if kind == "application/json":
+        for row in _iter_json_array(text):
+            yield Recipient.model_validate(row)
+        return
+    
+    if kind == "application/x-ndjson":
+        for line in text:
+            if line.strip():
+                yield Recipient.model_validate(json.loads(line))
+        return
+    
+    if kind in ("text/csv", "text/plain"):
+        reader = csv.DictReader(text, restval="")
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        for row in reader:
+            yield Recipient.model_validate(row)
+        return
+    
+    raise ValueError(f"Unsupported content type: {kind or 'none'}")
+
+class RecipientBatches:
+    """Reads a spooled upload batch by batch on a worker thread, keeping parsing off the event loop"""
+    
+    def __init__(self, body: IO[bytes], kind: str):
+        self.body = body
+        self.rows = iter_recipients(body, kind)
+        # A cancelled read keeps running on its thread; closing waits for it
+        self._lock = threading.Lock()
+    
+    def _read(self, limit: int) -> Tuple[List[Recipient], Optional[Exception]]:
+        batch = []
+        with self._lock:
+            try:
+                for row in self.rows:
+                    batch.append(row)
+                    if len(batch) >= limit:
+                        break
+            except PARSE_ERRORS as e:
+                return batch, e
+        return batch, None
+    
+    async def read(self, limit: int) -> Tuple[List[Recipient], Optional[Exception]]:
+        """Up to `limit` rows (none at the end), plus the parse error that ended reading early, if any"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, limit)
+    
+    def _close(self):
+        with self._lock:
+            self.rows.close()
+            self.body.close()
+    
+    def close(self):
+        if self._lock.locked():
+            asyncio.get_running_loop().run_in_executor(None, self._close)
+        else:
+            self._close()
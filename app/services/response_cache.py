@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used_at);
+"""
+
+_SPACES = re.compile(r"[ \t]+")
+
+def normalize_prompt(prompt: str) -> str:
+    """Whitespace differences that don't change the request map to the same key"""
+    lines = (_SPACES.sub(" ", line).strip() for line in prompt.replace("\r\n", "\n").split("\n"))
+    return "\n".join(lines).strip()
+
+class ResponseCache:
+    """Results of deterministic generations: in-memory LRU over an SQLite store
+    
+    Entries are keyed by the model identity, the normalized prompt and the
+    generation parameters, so they are only valid while generation is
+    deterministic (greedy). Concurrent requests for the same key share one
+    in-flight generation instead of each running the model.
+    
+    Every entry remembers how long its generation took; each hit adds that
+    to `saved_seconds`. SQLite access goes through a single-thread executor,
+    as in JobQueue.
+    """
+    
+    def __init__(self, model_id: str, max_entries: int = 1000, db_path: str = "", disk_max_entries: int = 100000):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.disk_max_entries = disk_max_entries
+        # key -> (text, generation seconds)
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache")
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.generation_seconds = 0.0
+    
+    def key(self, prompt: str, params: Dict[str, Any]) -> str:
+        source = json.dumps([self.model_id, normalize_prompt(prompt), params], sort_keys=True)
+        return hashlib.sha256(source.encode()).hexdigest()
+    
+    async def _db(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: fn(self._connection(), *args))
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+    
+    @staticmethod
+    def _load(conn: sqlite3.Connection, key: str) -> Optional[Tuple[str, float]]:
+        row = conn.execute("SELECT text, seconds FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row
+    
+    def _save(self, conn: sqlite3.Connection, key: str, text: str, seconds: float):
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, text, seconds, used_at) VALUES (?, ?, ?, ?)",
+            (key, text, seconds, time.time())
+        )
+        # Least recently used rows go first once the store is full
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,)
+        )
+    
+    def _remember(self, key: str, text: str, seconds: float):
+        self.entries[key] = (text, seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def _hit(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[1]
+        return entry[0]
+    
+    async def get_or_generate(self, prompt: str, params: Dict[str, Any], generate: Callable[[], Awaitable[str]]) -> str:
+        """Cached text for this request, or the result of `generate()` (run once per key at a time)
+        
+        Failures are not cached; every waiter on the failed generation gets
+        the exception.
+        """
+        key = self.key(prompt, params)
+        text = self._hit(key)
+        if text is not None:
+            return text
+        
+        pending = self.inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                text, seconds = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request running it went away: take over
+                return await self.get_or_generate(prompt, params, generate)
+            self.saved_seconds += seconds
+            return text
+        
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            stored = await self._db(self._load, key) if self.db_path else None
+            if stored:
+                self.disk_hits += 1
+                self.saved_seconds += stored[1]
+                text, seconds = stored
+            else:
+                self.misses += 1
+                started = time.perf_counter()
+                text = await generate()
+                seconds = time.perf_counter() - started
+                self.generation_seconds += seconds
+                if self.db_path:
+                    await self._db(self._save, key, text, seconds)
+            self._remember(key, text, seconds)
+            future.set_result((text, seconds))
+            return text
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+    
+    async def close(self):
+        if self._conn is not None:
+            await self._db(lambda conn: conn.close())
+            self._conn = None
+    
+    @property
+    def stats(self) -> Dict[str, Any]:
+        served = self.hits + self.disk_hits + self.coalesced
+        requests = served + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": round(served / requests, 3) if requests else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+            "generation_seconds": round(self.generation_seconds, 2)
+        }
@@ -0,0 +1,69 @@
+import threading
+import time
+from typing import Any, Dict
+
+class SpeculativeDecoder:
+    """Assisted generation: a small draft model proposes tokens, the main model verifies them
+    
+    Each step the draft model proposes up to `num_tokens` tokens one at a
+    time, then the main model scores all of them in a single forward pass
+    and keeps the longest prefix that matches its own choice plus one token
+    of its own. Output is what the main model would have produced; the gain
+    depends on how often the draft guesses right.
+    
+    transformers only supports this for a single sequence, so it is used for
+    batches of one. Acceptance is measured with forward hooks: every draft
+    call proposes one token, and every main-model pass contributes exactly
+    one token that was not a draft token, so the rest were accepted.
+    """
+    
+    def __init__(self, model, draft_model, num_tokens: int = 5):
+        self.model = model
+        self.draft_model = draft_model
+        self.draft_model.generation_config.num_assistant_tokens = num_tokens
+        # Grow the proposal after a fully accepted step, shrink it after a miss
+        self.draft_model.generation_config.num_assistant_tokens_schedule = "heuristic"
+        self.model.register_forward_hook(self._count("main"))
+        self.draft_model.register_forward_hook(self._count("draft"))
+        self._local = threading.local()
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.tokens = 0
+        self.seconds = 0.0
+    
+    def _count(self, role: str):
+        def hook(module, inputs, outputs):
+            counts = getattr(self._local, "counts", None)
+            if counts is not None:
+                counts[role] += 1
+        return hook
+    
+    def generate(self, input_ids, **kwargs):
+        """model.generate with the draft model assisting (called from generation threads)"""
+        self._local.counts = counts = {"draft": 0, "main": 0}
+        started = time.perf_counter()
+        try:
+            outputs = self.model.generate(input_ids, assistant_model=self.draft_model, **kwargs)
+        finally:
+            self._local.counts = None
+        
+        new_tokens = outputs.shape[1] - input_ids.shape[1]
+        with self.lock:
+            self.runs += 1
+            self.proposed += counts["draft"]
+            self.accepted += max(0, new_tokens - counts["main"])
+            self.tokens += new_tokens
+            self.seconds += time.perf_counter() - started
+        return outputs
+    
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "proposed_tokens": self.proposed,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+            "tokens_per_second": round(self.tokens / self.seconds, 1) if self.seconds else 0.0
+        }
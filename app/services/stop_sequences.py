@@ -0,0 +1,48 @@
+from typing import List, Optional, Sequence
+
+def truncate_at_stop(text: str, stop: Sequence[str]) -> str:
+    """Text before the earliest stop sequence"""
+    cut = len(text)
+    for sequence in stop:
+        index = text.find(sequence) if sequence else -1
+        if index != -1:
+            cut = min(cut, index)
+    return text[:cut]
+
+class StopOnSequences:
+    """Stopping criterion for `model.generate`: ends once every row has hit a stop sequence or EOS
+    
+    Each call decodes only the tokens added since the previous call, plus
+    enough earlier ones to catch a stop sequence split across calls, so the
+    check stays cheap however long the output gets. A batch stops as a whole,
+    so rows that finished early are cut with truncate_at_stop afterwards.
+    """
+    
+    def __init__(self, tokenizer, stop: Sequence[str], prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop = tuple(s for s in stop if s)
+        self.prompt_length = prompt_length
+        # Every token decodes to at least one character
+        self.overlap = max((len(s) for s in self.stop), default=1)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.scanned: Optional[List[int]] = None
+        self.done: Optional[List[bool]] = None
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        rows, length = input_ids.shape
+        if self.done is None:
+            self.done = [False] * rows
+            self.scanned = [self.prompt_length] * rows
+        
+        for row in range(rows):
+            if self.done[row]:
+                continue
+            if length > self.prompt_length and input_ids[row, -1].item() == self.eos_token_id:
+                self.done[row] = True
+                continue
+            start = max(self.prompt_length, self.scanned[row] - self.overlap)
+            tail = self.tokenizer.decode(input_ids[row, start:], skip_special_tokens=True)
+            self.done[row] = any(s in tail for s in self.stop)
+            self.scanned[row] = length
+        
+        return all(self.done)
@@ -1,62 +1,265 @@
 from datetime import datetime, date
+from typing import Dict, List, Optional, Tuple
+import asyncio
 from app.config import settings
-from pymongo import MongoClient
+from app.services.ttl_cache import TTLCache
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+class QuotaLeases:
+    """Per-process quota leases for high-volume plans
+    
+    A lease reserves several requests in Mongo at once (the counter is bumped
+    up front) and hands them out locally, so only one request per lease pays a
+    round-trip. Reserved units are counted as used, so a user can never exceed
+    their limit; unused units are returned on shutdown or plan change.
+    """
+    
+    def __init__(self, lease_size: int = 50, plans: Optional[List[str]] = None):
+        self.lease_size = max(1, lease_size)
+        self.plans = plans if plans is not None else ["ULTRA", "BUSINESS"]
+        # user_id -> {"day", "user", "reserved", "remaining"}
+        self.leases: Dict[str, Dict] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.refills = 0
+        self.local_hits = 0
+        self.returned_units = 0
+    
+    def lock(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self.locks:
+            self.locks[user_id] = asyncio.Lock()
+        return self.locks[user_id]
+    
+    def take(self, user_id: str, today: str) -> Optional[dict]:
+        """Use one unit of a live lease, returns the user's view or None"""
+        lease = self.leases.get(user_id)
+        if not lease or lease["day"] != today or lease["remaining"] <= 0:
+            return None
+        
+        lease["remaining"] -= 1
+        self.local_hits += 1
+        return {**lease["user"], "daily_requests": lease["reserved"] - lease["remaining"]}
+    
+    def grant(self, user: dict, today: str, reserved: int, units: int):
+        """Keep the units of a fresh reservation beyond the one used right away"""
+        self.refills += 1
+        self.leases[str(user["_id"])] = {
+            "day": today,
+            "user": user,
+            "reserved": reserved,
+            "remaining": units - 1
+        }
+    
+    async def release(self, users_collection, user_id: Optional[str] = None):
+        """Give unused units back to Mongo in one batch (all users, or only one)"""
+        today = date.today().isoformat()
+        user_ids = [user_id] if user_id else list(self.leases)
+        
+        operations = []
+        for uid in user_ids:
+            lease = self.leases.pop(uid, None)
+            # Units leased on an earlier day expired with that day's counter
+            if lease and lease["day"] == today and lease["remaining"] > 0:
+                operations.append(UpdateOne(
+                    {"_id": lease["user"]["_id"], "last_request_date": today},
+                    {"$inc": {"daily_requests": -lease["remaining"]}}
+                ))
+                self.returned_units += lease["remaining"]
+        
+        if operations:
+            await users_collection.bulk_write(operations, ordered=False)
+    
+    @property
+    def stats(self) -> Dict:
+        return {
+            "active_leases": len(self.leases),
+            "refills": self.refills,
+            "local_hits": self.local_hits,
+            "returned_units": self.returned_units
+        }
 
 class SubscriptionService:
     """Service for managing user subscriptions and quotas"""
     
-    def __init__(self):
-        self.client = MongoClient(settings.mongodb_uri)
-        self.db = self.client[settings.mongodb_db]
-        self.users_collection = self.db["users"]
+    # Everything the quota and billing paths read (never the password hash)
+    QUOTA_PROJECTION = {"plan": 1, "daily_requests": 1, "last_request_date": 1}
+    
+    def __init__(
+        self,
+        users_collection,
+        leases: Optional[QuotaLeases] = None,
+        user_cache: Optional[TTLCache] = None
+    ):
+        # Async (Motor) collection from the shared application client
+        self.users_collection = users_collection
+        self.leases = leases
+        # Process-wide user_id -> document cache, refreshed by quota writes
+        self.user_cache = user_cache
     
     async def get_user(self, user_id: str):
         """Get user by ID"""
+        if self.user_cache:
+            user = self.user_cache.get(user_id)
+            if user is not None:
+                return user
+        
         try:
-            user = self.users_collection.find_one({"_id": ObjectId(user_id)})
-            return user
+            user = await self.users_collection.find_one(
+                {"_id": ObjectId(user_id)},
+                self.QUOTA_PROJECTION
+            )
         except:
             return None
+        
+        if user and self.user_cache:
+            self.user_cache.set(user_id, user)
+        return user
+    
+    async def ensure_indexes(self):
+        """Create the indexes the auth and quota paths rely on (idempotent)"""
+        # Login/register look users up by email; quota updates hit _id, which is always indexed
+        await self.users_collection.create_index("email", unique=True, name="email_unique")
     
     async def get_plan_limit(self, plan: str) -> int:
         """Get request limit for a plan"""
         return settings.plan_limits.get(plan.upper(), 3)
     
-    async def reset_daily_counter_if_needed(self, user: dict):
-        """Reset daily counter if it's a new day"""
-        today = date.today().isoformat()
-        last_request_date = user.get("last_request_date")
-        
-        if last_request_date != today:
-            self.users_collection.update_one(
-                {"_id": user["_id"]},
-                {
-                    "$set": {
-                        "daily_requests": 0,
-                        "last_request_date": today
-                    }
+    def _limit_expr(self) -> dict:
+        return {
+            "$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$plan", plan]}, "then": plan_limit}
+                    for plan, plan_limit in settings.plan_limits.items()
+                ],
+                "default": 3
+            }
+        }
+    
+    def _quota_filter(self, user_id: ObjectId, today: str) -> dict:
+        """Match the user only if one more request fits in today's quota"""
+        return {
+            "_id": user_id,
+            "$expr": {
+                "$or": [
+                    # BUSINESS plan has no limits
+                    {"$eq": ["$plan", "BUSINESS"]},
+                    # First request of a new day always fits
+                    {"$ne": ["$last_request_date", today]},
+                    {"$lt": [{"$ifNull": ["$daily_requests", 0]}, self._limit_expr()]}
+                ]
+            }
+        }
+    
+    def _units_for(self, plan: str) -> int:
+        if self.leases and plan in self.leases.plans:
+            return self.leases.lease_size
+        return 1
+    
+    async def _reserve(self, user_id: str, today: str, units: Optional[int] = None) -> Optional[dict]:
+        """Atomically roll over the daily counter, check the limit and reserve units
+        
+        By default lease plans reserve up to a full lease and everyone else
+        exactly one unit; pass `units` to ask for a fixed amount. Never grants
+        past the plan limit. Returns the user document as it was before the update.
+        """
+        try:
+            oid = ObjectId(user_id)
+        except Exception:
+            return None
+        
+        used = {
+            "$cond": [
+                {"$eq": ["$last_request_date", today]},
+                {"$ifNull": ["$daily_requests", 0]},
+                0
+            ]
+        }
+        if units is None:
+            lease_plans = self.leases.plans if self.leases else []
+            lease_size = self.leases.lease_size if self.leases else 1
+            units = {"$cond": [{"$in": ["$plan", lease_plans]}, lease_size, 1]}
+        wanted = {"$add": [used, units]}
+        
+        return await self.users_collection.find_one_and_update(
+            self._quota_filter(oid, today),
+            [{
+                "$set": {
+                    "daily_requests": {
+                        "$cond": [
+                            {"$eq": ["$plan", "BUSINESS"]},
+                            wanted,
+                            {"$min": [wanted, self._limit_expr()]}
+                        ]
+                    },
+                    "last_request_date": today
                 }
-            )
+            }],
+            projection=self.QUOTA_PROJECTION,
+            return_document=ReturnDocument.BEFORE
+        )
     
-    async def check_quota(self, user: dict) -> bool:
-        """Check if user has remaining quota"""
-        plan = user.get("plan", "FREE")
-        limit = await self.get_plan_limit(plan)
-        daily_requests = user.get("daily_requests", 0)
+    async def consume_quota(self, user_id: str) -> Optional[dict]:
+        """Check the daily quota and count one request
         
-        # BUSINESS plan has no limits
-        if plan == "BUSINESS":
-            return True
+        Returns the post-increment user document, or None if the user does not
+        exist or is out of quota.
+        """
+        today = date.today().isoformat()
         
-        return daily_requests < limit
+        if not self.leases:
+            user = await self._consume(user_id, today)
+        else:
+            user = self.leases.take(user_id, today)
+            if not user:
+                async with self.leases.lock(user_id):
+                    # Another request may have refilled while we waited
+                    user = self.leases.take(user_id, today) or await self._consume(user_id, today)
+        
+        if self.user_cache:
+            if user:
+                self.user_cache.set(user_id, user)
+            else:
+                self.user_cache.pop(user_id)
+        return user
     
-    async def increment_usage(self, user: dict):
-        """Increment user's daily request count"""
-        self.users_collection.update_one(
-            {"_id": user["_id"]},
-            {"$inc": {"daily_requests": 1}}
-        )
+    async def _consume(self, user_id: str, today: str) -> Optional[dict]:
+        before = await self._reserve(user_id, today)
+        if not before:
+            return None
+        
+        user, units = await self._granted(before, today, self._units_for(before.get("plan", "FREE")))
+        if units > 1:
+            self.leases.grant(user, today, user["daily_requests"], units)
+            user = {**user, "daily_requests": user["daily_requests"] - units + 1}
+        return user
+    
+    async def _granted(self, before: dict, today: str, requested: int) -> Tuple[dict, int]:
+        """Recompute what the update pipeline granted from the pre-update document"""
+        plan = before.get("plan", "FREE")
+        used = before.get("daily_requests", 0) if before.get("last_request_date") == today else 0
+        units = requested
+        if plan != "BUSINESS":
+            units = min(units, await self.get_plan_limit(plan) - used)
+        
+        return {**before, "daily_requests": used + units, "last_request_date": today}, units
+    
+    async def reserve_bulk(self, user_id: str, units: int) -> Tuple[Optional[dict], int]:
+        """Charge up to `units` requests in one atomic update
+        
+        Returns the post-update user document and how many units were granted
+        (fewer than asked when the plan limit is hit, 0 when nothing is left).
+        """
+        today = date.today().isoformat()
+        before = await self._reserve(user_id, today, units)
+        if not before:
+            if self.user_cache:
+                self.user_cache.pop(user_id)
+            return None, 0
+        
+        user, granted = await self._granted(before, today, units)
+        if self.user_cache:
+            self.user_cache.set(user_id, user)
+        return user, granted
     
     async def get_quota_status(self, user: dict) -> dict:
         """Get user's quota status"""
@@ -64,6 +267,10 @@ class SubscriptionService:
         limit = await self.get_plan_limit(plan)
         daily_requests = user.get("daily_requests", 0)
         
+        # A counter from a previous day no longer counts
+        if user.get("last_request_date") != date.today().isoformat():
+            daily_requests = 0
+        
         return {
             "plan": plan,
             "daily_limit": limit,
@@ -77,9 +284,16 @@ class SubscriptionService:
         if new_plan not in settings.plan_limits:
             return False
         
-        result = self.users_collection.update_one(
+        # Leased units were sized for the old plan
+        if self.leases:
+            await self.leases.release(self.users_collection, user_id)
+        
+        result = await self.users_collection.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": {"plan": new_plan.upper()}}
         )
         
+        if self.user_cache:
+            self.user_cache.pop(user_id)
+        
         return result.modified_count > 0
\ No newline at end of file
@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.services.mail_generator import MailGenerator
+from app.services.template_registry import CompiledTemplate
+
+class TemplateService:
+    """Stores user mail templates in MongoDB and compiles them through the registry"""
+    
+    SOURCE_PROJECTION = {"_id": 0, "name": 1, "subject": 1, "body": 1, "updated_at": 1}
+    
+    def __init__(self, templates_collection):
+        self.templates_collection = templates_collection
+        self.registry = MailGenerator.registry
+    
+    async def ensure_indexes(self):
+        """Template names are unique per user"""
+        await self.templates_collection.create_index(
+            [("user_id", 1), ("name", 1)],
+            unique=True,
+            name="user_template_unique"
+        )
+    
+    async def save(self, user_id: str, name: str, subject: str, body: str) -> Dict:
+        """Validate and store a template, replacing one with the same name
+        
+        Raises TemplateError before anything is written. Compiling also
+        trial-renders it, so templates that would fail on every recipient
+        are rejected here rather than at send time.
+        """
+        self.registry.compile(subject, body)
+        template = {"name": name, "subject": subject, "body": body, "updated_at": datetime.utcnow()}
+        await self.templates_collection.update_one(
+            {"user_id": user_id, "name": name},
+            {"$set": template},
+            upsert=True
+        )
+        return template
+    
+    async def list_templates(self, user_id: str) -> List[Dict]:
+        cursor = self.templates_collection.find({"user_id": user_id}, self.SOURCE_PROJECTION).sort("name", 1)
+        return await cursor.to_list(length=None)
+    
+    async def delete(self, user_id: str, name: str) -> bool:
+        result = await self.templates_collection.delete_one({"user_id": user_id, "name": name})
+        return result.deleted_count > 0
+    
+    async def get_source(self, user_id: str, name: str) -> Optional[Dict]:
+        return await self.templates_collection.find_one(
+            {"user_id": user_id, "name": name},
+            {"_id": 0, "subject": 1, "body": 1}
+        )
+    
+    async def load(self, user_id: str, name: str) -> Optional[CompiledTemplate]:
+        """Compiled template by name (compiled once per source, then served from the LRU)"""
+        source = await self.get_source(user_id, name)
+        if not source:
+            return None
+        return self.registry.compile(source["subject"], source["body"])
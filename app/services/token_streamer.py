@@ -0,0 +1,26 @@
+from typing import Callable, List, Optional, Sequence
+
+class BatchStreamer:
+    """Streamer for `model.generate` that hands each row's new token ids to its own callback
+    
+    generate first passes the prompt, which is skipped. After that it passes
+    one token per row per step, or a (1, n) block of accepted tokens when
+    assisted decoding is used.
+    """
+    
+    def __init__(self, callbacks: Sequence[Optional[Callable[[List[int]], None]]]):
+        self.callbacks = list(callbacks)
+        self.prompt_seen = False
+    
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        if value.dim() == 1:
+            value = value.unsqueeze(-1)
+        for row, callback in enumerate(self.callbacks):
+            if callback is not None:
+                callback(value[row].tolist())
+    
+    def end(self):
+        pass
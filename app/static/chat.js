@@ -104,7 +104,7 @@ async function sendMessage() {
     }
     
     try {
-        const response = await fetch(`${API_BASE}/chat/message`, {
+        const response = await fetch(`${API_BASE}/chat/message/stream`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${token}`,
@@ -120,14 +120,34 @@ async function sendMessage() {
         });
         
         if (response.ok) {
-            const data = await response.json();
-            
-            // Add messages to display
             displayMessage('user', content);
-            displayMessage('assistant', data.message);
+            const assistantDiv = displayMessage('assistant', '');
+            
+            // Read NDJSON frames as they arrive
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
             
-            // Update quota
-            updateQuota(data.quota_remaining);
+            while (true) {
+                const {done, value} = await reader.read();
+                if (done) break;
+                
+                buffer += decoder.decode(value, {stream: true});
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const frame = JSON.parse(line);
+                    
+                    if (frame.type === 'token') {
+                        assistantDiv.textContent += frame.text;
+                    } else if (frame.type === 'done') {
+                        assistantDiv.textContent = frame.message;
+                        updateQuota(frame.quota_remaining);
+                    }
+                }
+            }
             
             // Clear inputs
             messageInput.value = '';
@@ -147,6 +167,7 @@ function displayMessage(role, content) {
     messageDiv.textContent = content;
     messagesDiv.appendChild(messageDiv);
     messagesDiv.scrollTop = messagesDiv.scrollHeight;
+    return messageDiv;
 }
 
 async function updateQuota(remaining) {
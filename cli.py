@@ -3,7 +3,11 @@ import uvicorn
 import subprocess
 import webbrowser
 import os
+import sys
+import time
+import urllib.request
 from pathlib import Path
+from typing import Dict, List
 from rich.console import Console
 
 console = Console()
@@ -57,6 +61,651 @@ def reset_model():
     else:
         console.print("[yellow]→ No cache to clear[/]")
 
+@app.command()
+def rebuild_manifest(user_id: str = typer.Argument(None, help="Only rebuild this user")):
+    """Rebuild chat history manifests from the memory directory"""
+    console.print("[bold yellow]🗂️  Rebuilding chat manifests...[/]")
+    
+    from app.config import settings
+    from app.services.memory_service import MemoryService
+    
+    memory_service = MemoryService(settings.memory_dir)
+    if user_id:
+        counts = {user_id: memory_service.rebuild_manifest(user_id)}
+    else:
+        counts = memory_service.rebuild_all_manifests()
+    
+    for uid, count in counts.items():
+        console.print(f"[green]✓ {uid}: {count} chats[/]")
+
+def _process_tree(pid: int) -> List[int]:
+    """pid and all of its descendants (Linux /proc)"""
+    children: Dict[int, List[int]] = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+    
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+def _memory_mb(pids: List[int]) -> Dict[str, float]:
+    """Summed RSS and PSS in MB; PSS splits shared pages between the processes mapping them"""
+    totals = {"Rss": 0, "Pss": 0}
+    for pid in pids:
+        try:
+            for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+                key, value = line.split(":", 1)
+                if key in totals:
+                    totals[key] += int(value.split()[0])
+        except OSError:
+            continue
+    return {key: value / 1024 for key, value in totals.items()}
+
+def _status(port: int, path: str) -> int:
+    """HTTP status of a GET on the local server, 0 if it did not answer with a success"""
+    try:
+        return urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1).status
+    except Exception:
+        return 0
+
+def _ready(port: int) -> bool:
+    return _status(port, "/health/ready") == 200
+
+@app.command()
+def memory_profile(
+    workers: List[int] = typer.Option([1, 2, 4], "--workers", "-w", help="Worker counts to measure"),
+    port: int = typer.Option(8765, help="Port for the temporary server"),
+    target: str = typer.Option("app.main:app", help="ASGI app to serve"),
+    timeout: int = typer.Option(600, help="Seconds to wait for the model to load")
+):
+    """Report total RSS/PSS of the server for different uvicorn worker counts (Linux)"""
+    from rich.table import Table
+    
+    table = Table(title="Server memory (MB)")
+    for column in ("workers", "RSS total", "PSS total", "PSS / worker"):
+        table.add_column(column, justify="right")
+    
+    for count in workers:
+        console.print(f"[blue]→ Starting {count} worker(s)...[/]")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--workers", str(count), "--log-level", "warning"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            # Ready answers from whichever worker got the request, so also wait for memory to settle
+            deadline = time.monotonic() + timeout
+            previous = None
+            while time.monotonic() < deadline:
+                time.sleep(2)
+                memory = _memory_mb(_process_tree(server.pid))
+                if previous and _ready(port) and abs(memory["Pss"] - previous["Pss"]) < 0.01 * previous["Pss"]:
+                    break
+                previous = memory
+            else:
+                console.print(f"[red]✗ {count} worker(s) not ready after {timeout}s[/]")
+                continue
+            table.add_row(str(count), f"{memory['Rss']:.0f}", f"{memory['Pss']:.0f}", f"{memory['Pss'] / count:.0f}")
+        finally:
+            server.terminate()
+            server.wait()
+    
+    console.print(table)
+
+@app.command()
+def startup_time(
+    runs: int = typer.Option(3, help="Server starts to measure"),
+    port: int = typer.Option(8765, help="Port for the temporary server"),
+    target: str = typer.Option("app.main:app", help="ASGI app to serve"),
+    timeout: int = typer.Option(600, help="Seconds to wait for the model to load")
+):
+    """Seconds from process start to the first 200 from /health and from /health/ready
+    
+    The model loads in the background, so /health answers as soon as the
+    app is up. /health/ready answers once the model is loaded and warmed
+    up; when lifespan blocked on the load, /health answered at about that
+    point, minus the warm-up.
+    """
+    from rich.table import Table
+    
+    paths = ("/health", "/health/ready")
+    table = Table(title="Time to first 200 (s)")
+    for column in ("run",) + paths:
+        table.add_column(column, justify="right")
+    
+    totals = {path: 0.0 for path in paths}
+    for run in range(1, runs + 1):
+        console.print(f"[blue]→ Start {run}/{runs}...[/]")
+        started = time.monotonic()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        first: Dict[str, float] = {}
+        try:
+            while len(first) < len(paths) and time.monotonic() - started < timeout and server.poll() is None:
+                for path in paths:
+                    if path not in first and _status(port, path) == 200:
+                        first[path] = time.monotonic() - started
+                time.sleep(0.01)
+        finally:
+            server.terminate()
+            server.wait()
+        
+        if len(first) < len(paths):
+            console.print(f"[red]✗ No 200 from {', '.join(p for p in paths if p not in first)} after {timeout}s[/]")
+            raise typer.Exit(1)
+        for path in paths:
+            totals[path] += first[path]
+        table.add_row(str(run), *(f"{first[path]:.2f}" for path in paths))
+    
+    table.add_row("mean", *(f"{totals[path] / runs:.2f}" for path in paths))
+    console.print(table)
+
+def _cpu_seconds(pids: List[int]) -> float:
+    """Summed user + system CPU time of the processes (Linux /proc)"""
+    ticks = 0
+    for pid in pids:
+        try:
+            fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+@app.command()
+def abort_test(
+    clients: int = typer.Option(8, help="Concurrent streaming clients"),
+    abort_fraction: float = typer.Option(0.5, help="Share of clients that disconnect mid-generation"),
+    abort_after: float = typer.Option(2.0, help="Seconds before those clients disconnect"),
+    port: int = typer.Option(8765, help="Port for the temporary server"),
+    target: str = typer.Option("app.main:app", help="ASGI app to serve"),
+    timeout: int = typer.Option(600, help="Seconds to wait for the model to load")
+):
+    """Server CPU time for a burst of chat streams, without and with clients disconnecting mid-generation (Linux)"""
+    import threading
+    import uuid
+    import requests
+    from rich.table import Table
+    
+    url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while not _ready(port):
+            if time.monotonic() > deadline or server.poll() is not None:
+                console.print(f"[red]✗ Server not ready after {timeout}s[/]")
+                raise typer.Exit(1)
+            time.sleep(1)
+        
+        # One unlimited account, so neither quota nor per-plan admission limits get in the way
+        response = requests.post(f"{url}/api/auth/register", json={"email": f"abort-{uuid.uuid4().hex[:8]}@loadtest.example.com", "password": "loadtest"})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        requests.post(f"{url}/api/billing/upgrade", headers=headers, json={"new_plan": "BUSINESS"}).raise_for_status()
+        
+        def client(abort: bool, outcomes: List[str]):
+            body = {"chat_id": "", "content": "Write a short cold email to the CTO of Acme about our outreach platform."}
+            started = time.monotonic()
+            with requests.post(f"{url}/api/chat/message/stream", headers=headers, json=body, stream=True, timeout=600) as response:
+                for _ in response.iter_lines():
+                    if abort and time.monotonic() - started > abort_after:
+                        outcomes.append("aborted")
+                        return  # closes the connection
+                outcomes.append("completed" if response.status_code == 200 else str(response.status_code))
+        
+        def settled() -> float:
+            """Server CPU seconds once it has gone idle again"""
+            previous = _cpu_seconds(_process_tree(server.pid))
+            while True:
+                time.sleep(1)
+                current = _cpu_seconds(_process_tree(server.pid))
+                if current - previous < 0.05:
+                    return current
+                previous = current
+        
+        table = Table(title=f"{clients} concurrent chat streams")
+        for column in ("aborting", "completed", "aborted", "server CPU s", "wall s"):
+            table.add_column(column, justify="right")
+        
+        for fraction in (0.0, abort_fraction):
+            aborting = int(clients * fraction)
+            console.print(f"[blue]→ {clients} streams, {aborting} disconnecting after {abort_after}s...[/]")
+            before = settled()
+            started = time.monotonic()
+            outcomes: List[str] = []
+            threads = [threading.Thread(target=client, args=(i < aborting, outcomes)) for i in range(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cpu = settled() - before
+            table.add_row(
+                f"{aborting}/{clients}", str(outcomes.count("completed")), str(outcomes.count("aborted")),
+                f"{cpu:.1f}", f"{time.monotonic() - started:.1f}"
+            )
+        
+        console.print(table)
+    finally:
+        server.terminate()
+        server.wait()
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+@app.command()
+def load_test(
+    url: str = typer.Option("http://127.0.0.1:8000", help="Running server to test"),
+    free_users: int = typer.Option(60, help="FREE accounts to create (3 requests/day each)"),
+    free_clients: int = typer.Option(32, help="Concurrent FREE clients"),
+    business_rate: float = typer.Option(0.5, help="BUSINESS requests per second"),
+    duration: int = typer.Option(60, help="Seconds of load"),
+    target_p95: float = typer.Option(15.0, help="BUSINESS p95 latency target in seconds")
+):
+    """Saturate generation with FREE traffic and check BUSINESS p95 latency"""
+    import random
+    import threading
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    from rich.table import Table
+    
+    run = uuid.uuid4().hex[:8]
+    
+    def register(name: str) -> Dict[str, str]:
+        response = requests.post(f"{url}/api/auth/register", json={"email": f"{name}-{run}@loadtest.example.com", "password": "loadtest"})
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    console.print(f"[blue]→ Creating 1 BUSINESS and {free_users} FREE accounts...[/]")
+    business = register("business")
+    requests.post(f"{url}/api/billing/upgrade", headers=business, json={"new_plan": "BUSINESS"}).raise_for_status()
+    with ThreadPoolExecutor(8) as pool:
+        free = list(pool.map(register, [f"free{i}" for i in range(free_users)]))
+    
+    results: Dict[str, List] = {"BUSINESS": [], "FREE": []}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    
+    def send(plan: str, headers: Dict[str, str]) -> requests.Response:
+        started = time.monotonic()
+        response = None
+        code = 0
+        body = {"chat_id": "", "content": "Write a short cold email to the CTO of Acme about our outreach platform."}
+        try:
+            with requests.post(f"{url}/api/chat/message/stream", headers=headers, json=body, stream=True, timeout=300) as response:
+                for _ in response.iter_lines():
+                    pass
+                code = response.status_code
+        except requests.RequestException:
+            pass
+        with lock:
+            results[plan].append((code, time.monotonic() - started))
+        return response
+    
+    def free_client():
+        while time.monotonic() < deadline:
+            response = send("FREE", random.choice(free))
+            if response is None or response.status_code != 200:
+                # Well-behaved clients back off as told
+                retry_after = response.headers.get("Retry-After") if response is not None else None
+                time.sleep(min(float(retry_after or 0.1), max(0.0, deadline - time.monotonic())))
+    
+    console.print(f"[blue]→ {free_clients} FREE clients flat out, BUSINESS at {business_rate}/s for {duration}s...[/]")
+    clients = [threading.Thread(target=free_client) for _ in range(free_clients)]
+    for client in clients:
+        client.start()
+    business_requests = []
+    while time.monotonic() < deadline:
+        request = threading.Thread(target=send, args=("BUSINESS", business))
+        request.start()
+        business_requests.append(request)
+        time.sleep(1 / business_rate)
+    for thread in clients + business_requests:
+        thread.join()
+    
+    table = Table(title="Generation under load")
+    for column in ("plan", "requests", "200", "429", "503", "other", "p50 s", "p95 s"):
+        table.add_column(column, justify="right")
+    for plan, rows in results.items():
+        codes = [code for code, _ in rows]
+        ok = [seconds for code, seconds in rows if code == 200]
+        other = len(codes) - sum(codes.count(c) for c in (200, 429, 503))
+        table.add_row(
+            plan, str(len(rows)), str(codes.count(200)), str(codes.count(429)), str(codes.count(503)), str(other),
+            f"{_percentile(ok, 50):.2f}", f"{_percentile(ok, 95):.2f}"
+        )
+    console.print(table)
+    
+    business_p95 = _percentile([seconds for code, seconds in results["BUSINESS"] if code == 200], 95)
+    if business_p95 <= target_p95 and all(code == 200 for code, _ in results["BUSINESS"]):
+        console.print(f"[green]✓ BUSINESS p95 {business_p95:.2f}s within {target_p95}s[/]")
+    else:
+        console.print(f"[red]✗ BUSINESS p95 {business_p95:.2f}s, target {target_p95}s[/]")
+        raise typer.Exit(1)
+
+@app.command()
+def login_storm(
+    url: str = typer.Option("http://127.0.0.1:8000", help="Running server to test"),
+    clients: int = typer.Option(64, help="Concurrent clients logging in flat out"),
+    duration: int = typer.Option(20, help="Seconds per phase"),
+    probe_interval: float = typer.Option(0.1, help="Seconds between latency probes")
+):
+    """/health and /api/chat/message latency on their own and while a login storm keeps bcrypt busy"""
+    import threading
+    import uuid
+    import requests
+    from rich.table import Table
+    
+    run = uuid.uuid4().hex[:8]
+    
+    def register(name: str) -> tuple:
+        credentials = {"email": f"{name}-{run}@loadtest.example.com", "password": "loadtest"}
+        response = requests.post(f"{url}/api/auth/register", json=credentials)
+        response.raise_for_status()
+        return credentials, {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    console.print("[blue]→ Creating accounts...[/]")
+    storm_credentials, _ = register("storm")
+    _, chat_headers = register("chat")
+    # Enough quota for every chat probe
+    requests.post(f"{url}/api/billing/upgrade", headers=chat_headers, json={"new_plan": "BUSINESS"}).raise_for_status()
+    
+    def phase(storm: bool) -> Dict[str, List]:
+        results: Dict[str, List] = {"health": [], "chat": [], "logins": []}
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+        
+        def probe(name: str, send):
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    ok = send().status_code == 200
+                except requests.RequestException:
+                    ok = False
+                if ok:
+                    with lock:
+                        results[name].append(time.monotonic() - started)
+                time.sleep(probe_interval)
+        
+        def login():
+            session = requests.Session()
+            while time.monotonic() < deadline:
+                try:
+                    code = session.post(f"{url}/api/auth/login", json=storm_credentials, timeout=30).status_code
+                except requests.RequestException:
+                    code = 0
+                with lock:
+                    results["logins"].append(code)
+        
+        body = {"chat_id": "", "content": "Write a short cold email to the CTO of Acme about our outreach platform."}
+        threads = [
+            threading.Thread(target=probe, args=("health", lambda: requests.get(f"{url}/health", timeout=30))),
+            threading.Thread(target=probe, args=("chat", lambda: requests.post(f"{url}/api/chat/message", headers=chat_headers, json=body, timeout=300)))
+        ]
+        if storm:
+            threads += [threading.Thread(target=login) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    table = Table(title=f"Latency with and without {clients} clients logging in")
+    for column in ("phase", "/health p50 ms", "/health p99 ms", "chat p50 s", "chat p95 s", "logins/s", "login 503"):
+        table.add_column(column, justify="right")
+    
+    for storm in (False, True):
+        console.print(f"[blue]→ {duration}s {'with' if storm else 'without'} the login storm...[/]")
+        results = phase(storm)
+        health, chat, logins = results["health"], results["chat"], results["logins"]
+        table.add_row(
+            "login storm" if storm else "quiet",
+            f"{_percentile(health, 50) * 1000:.1f}", f"{_percentile(health, 99) * 1000:.1f}",
+            f"{_percentile(chat, 50):.2f}", f"{_percentile(chat, 95):.2f}",
+            f"{logins.count(200) / duration:.1f}" if storm else "-",
+            str(logins.count(503)) if storm else "-"
+        )
+    
+    console.print(table)
+
+@app.command()
+def bulk_benchmark(
+    url: str = typer.Option("http://127.0.0.1:8000", help="Running server to test"),
+    rows: int = typer.Option(100, help="Recipients per run"),
+    concurrency: int = typer.Option(1, help="Requests in flight at once for the per-request loop")
+):
+    """Rows/sec of one /api/chat/bulk upload against one /api/chat/message call per recipient"""
+    import csv
+    import io
+    import json
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    from rich.table import Table
+    
+    response = requests.post(f"{url}/api/auth/register", json={"email": f"bulk-{uuid.uuid4().hex[:8]}@loadtest.example.com", "password": "loadtest"})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    requests.post(f"{url}/api/billing/upgrade", headers=headers, json={"new_plan": "BUSINESS"}).raise_for_status()
+    
+    recipients = [
+        {"name": f"Lead {i}", "company": f"Company {i}", "job_title": "CTO", "context": "Met at SaaStr"}
+        for i in range(rows)
+    ]
+    
+    console.print(f"[blue]→ {rows} rows as one bulk upload...[/]")
+    upload = io.StringIO()
+    writer = csv.DictWriter(upload, fieldnames=list(recipients[0]))
+    writer.writeheader()
+    writer.writerows(recipients)
+    started = time.monotonic()
+    frames = []
+    with requests.post(
+        f"{url}/api/chat/bulk",
+        headers={**headers, "Content-Type": "text/csv"},
+        data=upload.getvalue().encode(),
+        stream=True,
+        timeout=3600
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                frames.append(json.loads(line)["type"])
+    bulk_seconds = time.monotonic() - started
+    bulk_ok = frames.count("result")
+    
+    console.print(f"[blue]→ {rows} rows as one /api/chat/message call each ({concurrency} at a time)...[/]")
+    
+    def send(recipient: Dict[str, str]) -> bool:
+        body = {
+            "chat_id": "",
+            "content": f"Write a cold email to {recipient['name']} at {recipient['company']}.",
+            "recipient_name": recipient["name"],
+            "company": recipient["company"],
+            "job_title": recipient["job_title"]
+        }
+        return requests.post(f"{url}/api/chat/message", headers=headers, json=body, timeout=600).status_code == 200
+    
+    started = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        loop_ok = sum(pool.map(send, recipients))
+    loop_seconds = time.monotonic() - started
+    
+    table = Table(title=f"{rows} recipients")
+    for column in ("path", "ok", "seconds", "rows/s"):
+        table.add_column(column, justify="right")
+    table.add_row("bulk upload", str(bulk_ok), f"{bulk_seconds:.1f}", f"{bulk_ok / bulk_seconds:.2f}")
+    table.add_row("per-request loop", str(loop_ok), f"{loop_seconds:.1f}", f"{loop_ok / loop_seconds:.2f}")
+    console.print(table)
+    if bulk_ok and loop_ok:
+        console.print(f"[green]✓ Bulk is {(bulk_ok / bulk_seconds) / (loop_ok / loop_seconds):.1f}x the per-request loop[/]")
+
+@app.command()
+def scheduler_benchmark(
+    callers: List[int] = typer.Option([1, 8, 32], help="Concurrent callers to test (repeatable)"),
+    requests_per_caller: int = typer.Option(4, help="Generations each caller runs back to back"),
+    max_new_tokens: int = typer.Option(64, help="Tokens to generate per request"),
+    mock_step_ms: float = typer.Option(5.0, help="Time one forward pass of the mock model takes, whatever the batch size")
+):
+    """Tokens/sec of the batching scheduler against one generation per call, at several concurrency levels
+    
+    Runs in-process against MODEL_BACKEND; with MODEL_BACKEND=mock no weights
+    are needed, and the mock model sleeps `mock_step_ms` per token while
+    holding a lock, like a single device shared by all callers.
+    """
+    import asyncio
+    import threading
+    from rich.table import Table
+    from app.config import settings
+    from app.services.bitnet_loader import BitNetLoader
+    from app.services.generation_scheduler import GenerationRequest, GenerationScheduler
+    
+    prompt = "USER: Write a short cold email to the CTO of Acme about our outreach platform.\nASSISTANT:"
+    params = {"max_new_tokens": max_new_tokens, "stop": ("\nUSER:",)}
+    
+    async def run() -> Table:
+        loader = BitNetLoader(settings)
+        console.print(f"[blue]→ Loading {loader.backend.name} model...[/]")
+        if not await loader.wait_ready():
+            console.print(f"[red]✗ Model {loader.state}: {loader.error}[/]")
+            raise typer.Exit(1)
+        
+        device = threading.Lock()
+        
+        def mock_run_batch(batch: List[GenerationRequest]) -> List[str]:
+            with device:
+                time.sleep(mock_step_ms / 1000 * max_new_tokens)
+            return loader._run_batch(batch)
+        
+        run_batch = mock_run_batch if loader._is_mock() else loader._run_batch
+        
+        async def unbatched() -> str:
+            # The path before the scheduler: every call runs its own batch of one on the default executor
+            loop = asyncio.get_running_loop()
+            request = GenerationRequest(prompt=prompt, params=params, future=loop.create_future())
+            outputs = await loop.run_in_executor(None, run_batch, [request])
+            return outputs[0]
+        
+        scheduler = GenerationScheduler(
+            run_batch,
+            max_batch_size=settings.generation_max_batch_size,
+            max_wait_ms=settings.generation_max_wait_ms
+        )
+        
+        async def batched() -> str:
+            return await scheduler.submit(prompt, **params)
+        
+        async def measure(generate, count: int) -> float:
+            async def caller() -> int:
+                tokens = 0
+                for _ in range(requests_per_caller):
+                    tokens += loader.count_tokens(await generate())
+                return tokens
+            
+            started = time.monotonic()
+            tokens = sum(await asyncio.gather(*(caller() for _ in range(count))))
+            return tokens / (time.monotonic() - started)
+        
+        table = Table(title=f"{loader.backend.name} model, batches of up to {settings.generation_max_batch_size}")
+        for column in ("callers", "one per call tok/s", "scheduler tok/s", "speedup"):
+            table.add_column(column, justify="right")
+        try:
+            for count in callers:
+                console.print(f"[blue]→ {count} concurrent caller(s)...[/]")
+                before = await measure(unbatched, count)
+                after = await measure(batched, count)
+                table.add_row(str(count), f"{before:.1f}", f"{after:.1f}", f"{after / before:.1f}x")
+        finally:
+            await scheduler.stop()
+        return table
+    
+    console.print(asyncio.run(run()))
+
+def _benchmark_backend(backend: str, max_new_tokens: int, runs: int, results):
+    """Load and time one backend in a fresh process, so its memory is not mixed with another's"""
+    import asyncio
+    from app.config import settings
+    from app.services.bitnet_loader import BitNetLoader
+    
+    prompt = "USER: Write a short cold email to the CTO of Acme about our outreach platform.\nASSISTANT:"
+    
+    async def run() -> Dict:
+        loader = BitNetLoader(settings.model_copy(update={"model_backend": backend}))
+        if not await loader.wait_ready():
+            return {"error": f"model {loader.state}: {loader.error}"}
+        # Ends up on the mock model when the weights could not be loaded
+        if loader._is_mock() and backend != "mock":
+            return {"error": "fell back to the mock model"}
+        
+        tokens = 0
+        started = time.monotonic()
+        for _ in range(runs):
+            tokens += loader.count_tokens(await loader.scheduler.submit(prompt, max_new_tokens=max_new_tokens, stop=()))
+        seconds = time.monotonic() - started
+        await loader.unload()
+        return {"load_seconds": loader.load_seconds, "rss_mb": _memory_mb([os.getpid()])["Rss"], "tokens_per_second": tokens / seconds}
+    
+    try:
+        results.put(asyncio.run(run()))
+    except Exception as e:
+        results.put({"error": str(e)})
+
+@app.command()
+def backend_benchmark(
+    backends: List[str] = typer.Option(["mock", "hf", "cpu-int8"], "--backend", "-b", help="Backends to measure (repeatable)"),
+    max_new_tokens: int = typer.Option(64, help="Tokens to generate per run"),
+    runs: int = typer.Option(3, help="Generations to time per backend")
+):
+    """Load time (with warm-up), resident memory and tokens/sec of each MODEL_BACKEND (Linux)
+    
+    Each backend runs in its own process against the weights in
+    MODEL_CACHE_DIR, downloading them first if needed.
+    """
+    import multiprocessing
+    import queue
+    from rich.table import Table
+    
+    table = Table(title=f"Model backends, {runs} x {max_new_tokens} tokens")
+    for column in ("backend", "load s", "RSS MB", "tok/s"):
+        table.add_column(column, justify="right")
+    
+    context = multiprocessing.get_context("spawn")
+    for backend in backends:
+        console.print(f"[blue]→ {backend}...[/]")
+        results = context.Queue()
+        process = context.Process(target=_benchmark_backend, args=(backend, max_new_tokens, runs, results))
+        process.start()
+        process.join()
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            result = {"error": f"benchmark process exited with code {process.exitcode}"}
+        if "error" in result:
+            console.print(f"[red]✗ {backend}: {result['error']}[/]")
+            table.add_row(backend, "-", "-", "-")
+            continue
+        table.add_row(backend, f"{result['load_seconds']:.2f}", f"{result['rss_mb']:.0f}", f"{result['tokens_per_second']:.1f}")
+    
+    console.print(table)
+
 @app.command()
 def docker_up():
     """Start with Docker Compose"""
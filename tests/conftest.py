@@ -0,0 +1,61 @@
+import asyncio
+import inspect
+import os
+from uuid import uuid4
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+class Interleaved:
+    """Collection proxy that yields to the event loop around every operation
+    
+    mongomock runs each call to completion without yielding, so concurrent
+    read-modify-write code could never race against it. A real server
+    round-trip lets other requests run in between; this does the same.
+    """
+    
+    def __init__(self, collection):
+        self._collection = collection
+    
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+        
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            result = await attr(*args, **kwargs)
+            await asyncio.sleep(0)
+            return result
+        return call
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def db():
+    """A fresh database: on TEST_MONGODB_URI if set (dropped afterwards), else in-memory mongomock"""
+    if not real_mongo():
+        yield AsyncMongoMockClient()["test_db"]
+        return
+    
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.getenv("TEST_MONGODB_URI"), serverSelectionTimeoutMS=5000)
+    name = f"test_{uuid4().hex[:12]}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+@pytest.fixture
+def users(db):
+    """The users collection, interleaved when it is mongomock"""
+    if real_mongo():
+        return db["users"]
+    return Interleaved(db["users"])
+
+def real_mongo() -> bool:
+    """Whether tests run against a real server rather than mongomock"""
+    return bool(os.getenv("TEST_MONGODB_URI"))
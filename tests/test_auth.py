@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from datetime import datetime
+
+import bcrypt
+import httpx
+import pytest
+
+import app.routes.auth
+from app.dependencies import get_users_collection
+from app.main import app as fastapi_app
+from app.services.password_hasher import HashingPoolSaturated, PasswordHasher
+
+pytestmark = pytest.mark.anyio
+
+CREDENTIALS = {"email": "storm@example.com", "password": "correct horse"}
+
+@pytest.fixture
+async def users(db):
+    await db["users"].insert_one({
+        "email": CREDENTIALS["email"],
+        "password_hash": bcrypt.hashpw(CREDENTIALS["password"].encode(), bcrypt.gensalt(4)).decode(),
+        "plan": "FREE",
+        "daily_requests": 0,
+        "created_at": datetime.utcnow()
+    })
+    return db["users"]
+
+@pytest.fixture
+def hasher(monkeypatch):
+    """One worker and no queue, so a single running hash saturates it"""
+    hasher = PasswordHasher(workers=1, queue_limit=0)
+    monkeypatch.setattr(app.routes.auth, "password_hasher", hasher)
+    yield hasher
+    hasher.executor.shutdown(wait=False)
+
+@pytest.fixture
+def client(users):
+    fastapi_app.dependency_overrides[get_users_collection] = lambda: users
+    transport = httpx.ASGITransport(app=fastapi_app)
+    yield httpx.AsyncClient(transport=transport, base_url="http://test")
+    fastapi_app.dependency_overrides.clear()
+
+async def test_saturated_hasher_rejects_logins_with_retry_after(client, hasher):
+    busy = threading.Event()
+    occupied = asyncio.ensure_future(hasher._run(busy.wait))
+    await asyncio.sleep(0)
+    try:
+        response = await client.post("/api/auth/login", json=CREDENTIALS)
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert hasher.rejected == 1
+    finally:
+        busy.set()
+        await occupied
+    
+    response = await client.post("/api/auth/login", json=CREDENTIALS)
+    assert response.status_code == 200
+
+async def test_hasher_admits_workers_plus_queue_then_rejects():
+    hasher = PasswordHasher(workers=2, queue_limit=3)
+    busy = threading.Event()
+    admitted = [asyncio.ensure_future(hasher._run(busy.wait)) for _ in range(5)]
+    await asyncio.sleep(0)
+    
+    with pytest.raises(HashingPoolSaturated):
+        await hasher.verify("password", "hash")
+    assert hasher.stats == {"in_flight": 5, "rejected": 1}
+    
+    busy.set()
+    await asyncio.gather(*admitted)
+    assert hasher.in_flight == 0
+    hasher.executor.shutdown()
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+from app.config import settings
+from app.services.bitnet_loader import BitNetLoader
+from app.services.generation_scheduler import GenerationRequest
+
+WORDS = [f"w{i}" for i in range(50)]
+
+class EchoModel:
+    """Stands in for a causal LM: every prompt is continued with one more word"""
+    
+    def generate(self, input_ids, **kwargs):
+        return torch.cat([input_ids, torch.full((input_ids.shape[0], 1), 2)], dim=1)
+
+class StubBackend:
+    name = "stub"
+    
+    def load(self, model_path):
+        vocab = {word: i for i, word in enumerate(["[PAD]", "[UNK]"] + WORDS)}
+        tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        return EchoModel(), PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="[PAD]", unk_token="[UNK]")
+
+@pytest.fixture
+def loader():
+    loader = BitNetLoader(settings.model_copy(update={"generation_deterministic": False}))
+    loader.backend = StubBackend()
+    loader.model, loader.tokenizer, loader.loop_tokenizer = loader._load_model("")
+    return loader
+
+def test_token_counting_runs_alongside_padded_batches(loader):
+    """The event loop counts tokens while the scheduler thread pads batches of uneven prompts"""
+    batch = [
+        GenerationRequest(prompt=" ".join(WORDS[:n]), params={"max_new_tokens": 1}, future=None)
+        for n in (3, 9)
+    ]
+    stop = threading.Event()
+    errors = []
+    
+    def scheduler_thread():
+        while not stop.is_set():
+            try:
+                assert loader._run_batch(batch) == ["w0", "w0"]
+            except Exception as e:
+                errors.append(e)
+                return
+    
+    thread = threading.Thread(target=scheduler_thread)
+    thread.start()
+    try:
+        for _ in range(5000):
+            assert loader.count_tokens(" ".join(WORDS)) == len(WORDS)
+            assert loader.loop_tokenizer.decode([2, 3]) == "w0 w1"
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
+
+class PieceTokenizer:
+    """Decodes ids to fixed text pieces; id 3 is the first byte of a character cut off by max_new_tokens"""
+    
+    PIECES = {1: "Hello", 2: " wor", 3: "�"}
+    
+    def decode(self, ids, **kwargs):
+        return "".join(self.PIECES[i] for i in ids)
+
+@pytest.mark.anyio
+async def test_stream_flushes_text_after_the_last_clean_decode(loader):
+    loader.loop_tokenizer = PieceTokenizer()
+    loader.state = "ready"
+    loader._startup = asyncio.get_running_loop().create_future()
+    loader._startup.set_result(None)
+    
+    async def submit(prompt, on_tokens=None, **params):
+        for ids in ([1], [2, 3]):
+            on_tokens(ids)
+        return ""
+    loader.scheduler.submit = submit
+    
+    chunks = [chunk async for chunk in loader.stream("USER: hi\nASSISTANT:")]
+    assert "".join(chunks) == "Hello wor�"
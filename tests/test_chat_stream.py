@@ -0,0 +1,77 @@
+import json
+
+import httpx
+import pytest
+
+import app.routes.chat
+from app.dependencies import get_model_loader, get_subscription_service, get_template_service
+from app.main import app as fastapi_app
+from app.middleware.rate_limiter import generation_slot, get_current_user, increment_usage
+from app.services.memory_service import MemoryService
+
+pytestmark = pytest.mark.anyio
+
+class StreamingLoader:
+    """Streams a couple of chunks, then fails if given an error"""
+    
+    def __init__(self, error=None):
+        self.error = error
+    
+    async def stream(self, prompt, **params):
+        yield "Hello "
+        yield "there"
+        if self.error:
+            raise self.error
+
+class Slot:
+    def hand_off(self):
+        return self
+    
+    def release(self):
+        pass
+
+class Subscriptions:
+    async def get_quota_status(self, user):
+        return {"remaining": 2}
+
+@pytest.fixture
+async def memory(tmp_path, monkeypatch):
+    service = MemoryService(str(tmp_path))
+    monkeypatch.setattr(app.routes.chat, "memory_service", service)
+    yield service
+    await service.close()
+
+@pytest.fixture
+def client():
+    fastapi_app.dependency_overrides.update({
+        get_current_user: lambda: "u",
+        generation_slot: Slot,
+        increment_usage: lambda: {"_id": "u"},
+        get_subscription_service: Subscriptions,
+        get_template_service: lambda: None
+    })
+    transport = httpx.ASGITransport(app=fastapi_app)
+    yield httpx.AsyncClient(transport=transport, base_url="http://test")
+    fastapi_app.dependency_overrides.clear()
+
+async def stream(client, loader):
+    fastapi_app.dependency_overrides[get_model_loader] = lambda: loader
+    response = await client.post("/api/chat/message/stream", json={"chat_id": "", "content": "Hi"})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+async def test_stream_ends_with_done_and_saves_the_reply(client, memory):
+    frames = await stream(client, StreamingLoader())
+    
+    assert [f["type"] for f in frames] == ["token", "token", "done"]
+    chat = await memory.get_chat("u", frames[-1]["chat_id"])
+    assert [m["content"] for m in chat["messages"]] == ["Hi", "Hello there"]
+
+async def test_generation_failure_ends_the_stream_with_an_error_frame(client, memory):
+    frames = await stream(client, StreamingLoader(RuntimeError("Generation scheduler stopped")))
+    
+    assert [f["type"] for f in frames] == ["token", "token", "error"]
+    assert "Generation scheduler stopped" in frames[-1]["detail"]
+    # The partial reply is not stored as if it were complete
+    chat = await memory.get_chat("u", frames[-1]["chat_id"])
+    assert [m["content"] for m in chat["messages"]] == ["Hi"]
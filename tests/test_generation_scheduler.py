@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.generation_scheduler import GenerationScheduler
+
+pytestmark = pytest.mark.anyio
+
+class BlockingModel:
+    """run_batch that holds the model thread until released"""
+    
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.batches = []
+    
+    def __call__(self, batch):
+        self.batches.append(batch)
+        self.started.set()
+        self.release.wait(5)
+        return [request.prompt for request in batch]
+
+async def test_stop_fails_the_batch_that_is_generating():
+    model = BlockingModel()
+    scheduler = GenerationScheduler(model, max_batch_size=4, max_wait_ms=0)
+    callers = [asyncio.ensure_future(scheduler.submit(f"prompt {i}")) for i in range(2)]
+    await asyncio.get_running_loop().run_in_executor(None, model.started.wait, 5)
+    
+    try:
+        await scheduler.stop()
+        results = await asyncio.wait_for(asyncio.gather(*callers, return_exceptions=True), 1)
+    finally:
+        model.release.set()
+    
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # The model is told to stop decoding for them too
+    assert all(request.cancel.cancelled for request in model.batches[0])
+
+async def test_stop_fails_requests_still_being_gathered_into_a_batch():
+    model = BlockingModel()
+    scheduler = GenerationScheduler(model, max_batch_size=4, max_wait_ms=10000)
+    caller = asyncio.ensure_future(scheduler.submit("prompt"))
+    await asyncio.sleep(0.01)
+    
+    await scheduler.stop()
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(caller, 1)
+    assert model.batches == []
@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+from bson import ObjectId
+
+from app.services.subscription_service import SubscriptionService
+from app.services.template_service import TemplateService
+from tests.conftest import real_mongo
+
+pytestmark = pytest.mark.anyio
+
+USER_ID = ObjectId()
+
+# (collection, filter) of every query on the request hot path
+HOT_QUERIES = {
+    "register/login by email": ("users", {"email": "user@example.com"}),
+    "get_user and lease release by _id": ("users", {"_id": USER_ID}),
+    "quota check-and-increment": ("users", SubscriptionService(None)._quota_filter(USER_ID, date.today().isoformat())),
+    "template by name": ("templates", {"user_id": str(USER_ID), "name": "intro"}),
+    "template list": ("templates", {"user_id": str(USER_ID)})
+}
+
+def plan_stages(plan: dict):
+    """Every stage name in an explain plan tree"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+def equality_fields(query: dict) -> set:
+    return {field for field, value in query.items() if not field.startswith("$") and not isinstance(value, dict)}
+
+@pytest.fixture
+async def provisioned(db):
+    """Indexes as created at startup, plus enough documents for the planner to choose"""
+    await SubscriptionService(db["users"]).ensure_indexes()
+    await TemplateService(db["templates"]).ensure_indexes()
+    await db["users"].insert_many([{"email": f"user{i}@example.com", "plan": "FREE"} for i in range(20)])
+    await db["templates"].insert_many([{"user_id": str(i), "name": "intro"} for i in range(20)])
+    return db
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+async def test_hot_path_query_does_not_scan_the_collection(provisioned, name):
+    collection, query = HOT_QUERIES[name]
+    
+    if real_mongo():
+        explain = await provisioned.command({"explain": {"find": collection, "filter": query}, "verbosity": "queryPlanner"})
+        stages = set(plan_stages(explain["queryPlanner"]["winningPlan"]))
+        assert "COLLSCAN" not in stages, f"{name} scans {collection}: {stages}"
+        return
+    
+    # mongomock has no query planner: require an index led by a field the query matches exactly
+    indexes = await provisioned[collection].index_information()
+    leading = {index["key"][0][0] for index in indexes.values()}
+    assert leading & equality_fields(query), f"{name} has no index on {collection} to use"
@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.models.recipient_model import Recipient
+from app.services.job_queue import JobQueue
+
+pytestmark = pytest.mark.anyio
+
+class SlowLoader:
+    """Model stand-in that takes a little while per row and counts what it generated"""
+    
+    def __init__(self):
+        self.prompts = []
+    
+    async def generate(self, prompt, **params):
+        self.prompts.append(prompt)
+        await asyncio.sleep(0.01)
+        return "Hello"
+
+def recipients(count: int):
+    return [Recipient(recipient_name=f"R{i}", company="Acme") for i in range(count)]
+
+def row_states(db_path: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT id, status, claimed_by FROM job_rows ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def outcomes(rows):
+    return [(row["id"], row["job_id"], "done", {"message": "Hello"}) for row in rows]
+
+@pytest.fixture
+def queues(tmp_path):
+    """Two queues on one database, as in two `--workers` processes"""
+    path = str(tmp_path / "jobs.db")
+    return JobQueue(path, workers=1, batch_size=2, poll_interval_ms=10), JobQueue(path, workers=1, batch_size=2, poll_interval_ms=10)
+
+async def test_stopping_a_queue_leaves_other_queues_rows_alone(queues):
+    first, second = queues
+    job_id = await first.submit("u", recipients(4))
+    claimed = await first._db(first._claim)
+    
+    await second.start(SlowLoader())
+    await second.stop()
+    
+    mine = {row["id"] for row in claimed}
+    for row_id, status, claimed_by in row_states(first.db_path):
+        if row_id in mine:
+            assert (status, claimed_by) == ("running", first.claimant)
+    
+    stored = await first._db(first._checkpoint, outcomes(claimed))
+    assert len(stored) == 2
+    job = await first.get(job_id)
+    assert job["done"] <= job["total"]
+    await first.stop()
+
+async def test_restarting_one_queue_never_counts_a_row_twice(queues):
+    first, second = queues
+    first_loader, second_loader = SlowLoader(), SlowLoader()
+    job_id = await first.submit("u", recipients(40))
+    
+    await first.start(first_loader)
+    await second.start(second_loader)
+    for _ in range(3):
+        await asyncio.sleep(0.05)
+        await second.stop()
+        await second.start(second_loader)
+    
+    while (await first.get(job_id))["status"] != "completed":
+        await asyncio.sleep(0.01)
+    await first.stop()
+    await second.stop()
+    
+    job = await first.get(job_id)
+    assert (job["done"], job["failed"]) == (40, 0)
+    # Only the restarted queue's own rows are generated again; the other queue never loses one
+    assert len(set(first_loader.prompts)) == len(first_loader.prompts)
+
+async def test_expired_claims_are_taken_over_and_the_late_checkpoint_is_ignored(queues):
+    first, second = queues
+    job_id = await first.submit("u", recipients(2))
+    claimed = await first._db(first._claim)
+    
+    # The first queue stopped renewing (e.g. its process hung) for longer than the lease
+    await first._db(lambda conn: conn.execute("UPDATE job_rows SET claimed_at = claimed_at - ?", (first.lease_seconds + 1,)))
+    assert await second._db(second._requeue_stale) == 2
+    taken = await second._db(second._claim)
+    assert len(await second._db(second._checkpoint, outcomes(taken))) == 2
+    
+    assert await first._db(first._checkpoint, outcomes(claimed)) == []
+    job = await first.get(job_id)
+    assert (job["status"], job["done"], job["total"]) == ("completed", 2, 2)
+    await first.stop()
+    await second.stop()
+
+async def test_renewed_claims_are_not_requeued(queues):
+    first, second = queues
+    await first.submit("u", recipients(2))
+    claimed = await first._db(first._claim)
+    
+    await first._db(lambda conn: conn.execute("UPDATE job_rows SET claimed_at = claimed_at - ?", (first.lease_seconds + 1,)))
+    await first._db(first._renew, [row["id"] for row in claimed])
+    
+    assert await second._db(second._requeue_stale) == 0
+    await first.stop()
+    await second.stop()
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import date
+
+import pytest
+from bson import ObjectId
+
+from app.config import settings
+from app.services.subscription_service import QuotaLeases, SubscriptionService
+
+pytestmark = pytest.mark.anyio
+
+# Requests fired at once per wave
+PARALLEL = 50
+
+async def create_user(users, plan: str, daily_requests: int = 0) -> str:
+    result = await users.insert_one({
+        "email": f"{plan.lower()}@example.com",
+        "plan": plan,
+        "daily_requests": daily_requests,
+        "last_request_date": date.today().isoformat()
+    })
+    return str(result.inserted_id)
+
+async def used_today(users, user_id: str) -> int:
+    user = await users.find_one({"_id": ObjectId(user_id)})
+    return user["daily_requests"]
+
+async def consume_until_refused(service: SubscriptionService, user_id: str) -> int:
+    """Fire waves of parallel requests until a whole wave is refused, returns how many got through"""
+    granted = 0
+    while True:
+        results = await asyncio.gather(*(service.consume_quota(user_id) for _ in range(PARALLEL)))
+        wave = sum(1 for user in results if user)
+        if not wave:
+            return granted
+        granted += wave
+
+@pytest.mark.parametrize("plan", ["FREE", "PRO", "ULTRA"])
+async def test_parallel_requests_stop_exactly_at_plan_limit(users, plan):
+    leases = QuotaLeases(settings.quota_lease_size, settings.quota_lease_plans)
+    service = SubscriptionService(users, leases)
+    user_id = await create_user(users, plan)
+    
+    assert await consume_until_refused(service, user_id) == settings.plan_limits[plan]
+    assert await used_today(users, user_id) == settings.plan_limits[plan]
+
+@pytest.mark.parametrize("plan", ["FREE", "PRO", "ULTRA"])
+async def test_parallel_requests_use_only_what_is_left(users, plan):
+    limit = settings.plan_limits[plan]
+    used = max(0, limit - 7)
+    service = SubscriptionService(users, QuotaLeases(settings.quota_lease_size, settings.quota_lease_plans))
+    user_id = await create_user(users, plan, used)
+    
+    results = await asyncio.gather(*(service.consume_quota(user_id) for _ in range(PARALLEL)))
+    
+    assert sum(1 for user in results if user) == limit - used
+    # Every granted request saw its own count, so quota_remaining is never reported twice
+    counts = sorted(user["daily_requests"] for user in results if user)
+    assert counts == list(range(used + 1, limit + 1))
+    assert await used_today(users, user_id) == limit
+
+async def test_parallel_bulk_reservations_never_exceed_the_limit(users):
+    service = SubscriptionService(users)
+    user_id = await create_user(users, "PRO")
+    
+    results = await asyncio.gather(*(service.reserve_bulk(user_id, 7) for _ in range(PARALLEL)))
+    
+    assert sum(granted for _, granted in results) == settings.plan_limits["PRO"]
+    assert await used_today(users, user_id) == settings.plan_limits["PRO"]
+
+def worker(users) -> SubscriptionService:
+    """A service with its own leases, as in a separate uvicorn worker"""
+    return SubscriptionService(users, QuotaLeases(settings.quota_lease_size, settings.quota_lease_plans))
+
+async def test_workers_with_leases_never_exceed_the_limit(users):
+    user_id = await create_user(users, "ULTRA")
+    workers = [worker(users) for _ in range(4)]
+    
+    granted = await asyncio.gather(*(consume_until_refused(service, user_id) for service in workers))
+    
+    assert sum(granted) == settings.plan_limits["ULTRA"]
+    assert await used_today(users, user_id) == settings.plan_limits["ULTRA"]
+
+async def test_leased_but_unused_units_are_bounded_by_the_lease_size(users):
+    user_id = await create_user(users, "ULTRA")
+    workers = [worker(users) for _ in range(3)]
+    
+    for service in workers:
+        results = await asyncio.gather(*(service.consume_quota(user_id) for _ in range(10)))
+        assert all(results)
+    
+    # Each worker holds at most one lease, so the counter runs ahead by less than a lease per worker
+    counted = await used_today(users, user_id)
+    assert 30 < counted <= 30 + len(workers) * (settings.quota_lease_size - 1)
+    
+    for service in workers:
+        await service.leases.release(users)
+    assert await used_today(users, user_id) == 30
+
+async def test_lease_near_the_limit_only_reserves_what_is_left(users):
+    limit = settings.plan_limits["ULTRA"]
+    user_id = await create_user(users, "ULTRA", limit - 10)
+    first, second = worker(users), worker(users)
+    
+    assert await first.consume_quota(user_id)
+    assert await used_today(users, user_id) == limit
+    # The rest of the day's quota is leased to the first worker
+    assert await second.consume_quota(user_id) is None
+    assert await consume_until_refused(first, user_id) == 9
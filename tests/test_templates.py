@@ -0,0 +1,44 @@
+import pytest
+
+from app.services.template_registry import SAMPLE_FIELDS, TemplateRegistry
+from app.services.template_service import TemplateService
+
+pytestmark = pytest.mark.anyio
+
+NESTED = "Hi {{ recipient_name }}{% if company %} at {{ company }}{% if job_title %}, {{ job_title }}{% endif %}{% endif %}!"
+
+def fields(**overrides):
+    return {**{name: "" for name in SAMPLE_FIELDS}, **overrides}
+
+def test_nested_if_uses_the_format_renderer():
+    template = TemplateRegistry().compile("Hello", NESTED)
+    
+    assert template.body(fields(recipient_name="Ann", company="Acme", job_title="CTO")) == "Hi Ann at Acme, CTO!"
+    assert template.body(fields(recipient_name="Ann", company="Acme")) == "Hi Ann at Acme!"
+    assert template.body(fields(recipient_name="Ann", job_title="CTO")) == "Hi Ann!"
+
+@pytest.mark.parametrize("source", [
+    NESTED,
+    "{% if company %}{% if job_title %}{% if context %}{{ context }}{% endif %}{% endif %}{% endif %}",
+    "{% if company %}{% if job_title %}A{% endif %}{% if context %}B{% endif %}{% endif %}",
+])
+def test_format_renderer_matches_jinja(source):
+    registry = TemplateRegistry()
+    jinja = registry.env.from_string(source).render
+    fast = registry._renderer(source)
+    for company in ("", "Acme"):
+        for job_title in ("", "CTO"):
+            for context in ("", "ctx"):
+                row = fields(recipient_name="Ann", company=company, job_title=job_title, context=context)
+                assert fast(row) == jinja(row)
+
+async def test_nested_if_template_saves_and_renders(db):
+    service = TemplateService(db["templates"])
+    service.registry = TemplateRegistry()
+    
+    await service.save("u", "nested", "For {{ company }}", NESTED)
+    template = await service.load("u", "nested")
+    
+    mail = template.render(fields(recipient_name="Ann", company="Acme", job_title="CTO"))
+    assert mail["subject"] == "For Acme"
+    assert mail["body"] == "Hi Ann at Acme, CTO!"